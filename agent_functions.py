@@ -1,15 +1,91 @@
 from typing import List, Dict, Any, Optional
+import copy
 import json
-import uuid
-from data_processor import DataProcessor
-from vector_db import VectorDB
-from handover_simple_mock import handover_simple
+import secrets
 import re
+from functools import lru_cache
+try:
+    import ahocorasick
+except ImportError:  # pyahocorasick is optional; detect_intent falls back to precompiled regexes
+    ahocorasick = None
+from data_processor import DataProcessor, Order
+from vector_db import VectorDB
+from handover_simple_mock import handover_simple, EMAIL_RE
+
+# Maximum number of distinct (query, max_results) search responses kept per instance
+SEARCH_CACHE_SIZE = 256
+
+# Display labels for order status codes
+STATUS_DISPLAY = {
+    "processing": "處理中",
+    "shipped": "已出貨",
+    "in_transit": "運送中",
+    "delivered": "已送達"
+}
+
+# Intent keywords in priority order: the first intent with a matching keyword wins
+INTENT_KEYWORDS = [
+    # Order-related keywords
+    ('order', ['訂單', '物流', '追蹤', '配送', '出貨', '到貨', 'order', 'tracking', 'shipping', 'delivery']),
+    # Product search keywords
+    ('product', ['產品', '臂架', '支架', '螢幕', '推薦', '規格', '尺寸', 'vesa', 'arm', 'monitor', 'product']),
+    # Human handover keywords
+    ('handover', ['真人', '客服', '人工', '轉接', '協助', 'human', 'help', 'support', 'agent']),
+    # FAQ keywords
+    ('faq', ['政策', '退換貨', '保固', '發票', '運費', '付款', 'policy', 'return', 'warranty', 'payment']),
+]
+
+# One precompiled alternation per intent, used when pyahocorasick is not installed
+INTENT_PATTERNS = [
+    (intent, re.compile("|".join(map(re.escape, keywords))))
+    for intent, keywords in INTENT_KEYWORDS
+]
+
+def _optional_line(label: str, value: str) -> str:
+    """Render an optional '<label>: <value>' line (with its leading newline), or "" when the value is empty"""
+    return f"\n{label}: {value}" if value else ""
+
+def _order_to_dict(order: Order) -> Dict[str, Any]:
+    """Shallow dict view of an order for tool payloads (items are shared, not deep-copied)"""
+    return {
+        "order_id": order.order_id,
+        "placed_at": order.placed_at,
+        "status": order.status,
+        "carrier": order.carrier,
+        "tracking": order.tracking,
+        "eta": order.eta,
+        "items": order.items,
+        "shipping_address": order.shipping_address,
+        "contact_phone": order.contact_phone,
+        "order_url": order.order_url
+    }
 
 class JTCGAgentFunctions:
     def __init__(self, data_processor: DataProcessor, vector_db: VectorDB):
         self.data_processor = data_processor
         self.vector_db = vector_db
+        self._intent_automaton = self._build_intent_automaton() if ahocorasick else None
+
+        # Per-instance LRU caches for formatted search responses; exceptions are never cached
+        self._cached_search_knowledge_base = lru_cache(maxsize=SEARCH_CACHE_SIZE)(self._search_knowledge_base)
+        self._cached_search_products = lru_cache(maxsize=SEARCH_CACHE_SIZE)(self._search_products)
+
+    def clear_search_cache(self):
+        """Drop cached search responses (e.g. after the vector database is repopulated)"""
+        self._cached_search_knowledge_base.cache_clear()
+        self._cached_search_products.cache_clear()
+
+    @staticmethod
+    def _build_intent_automaton() -> "ahocorasick.Automaton":
+        """Build a single Aho-Corasick automaton mapping each keyword to (priority, intent)"""
+        automaton = ahocorasick.Automaton()
+        for priority, (intent, keywords) in enumerate(INTENT_KEYWORDS):
+            for keyword in keywords:
+                # Keep the highest-priority intent if a keyword appears in several lists
+                if keyword not in automaton:
+                    automaton.add_word(keyword, (priority, intent))
+        automaton.make_automaton()
+        return automaton
 
     def search_knowledge_base(self, query: str, max_results: int = 3) -> Dict[str, Any]:
         """
@@ -23,51 +99,9 @@ class JTCGAgentFunctions:
             Dictionary with search results and formatted response
         """
         try:
-            results = self.vector_db.search_knowledge(query, n_results=max_results)
-
-            if not results:
-                return {
-                    "success": False,
-                    "message": "很抱歉，目前無法找到相關的資訊。建議您聯繫我們的客服團隊以獲得進一步協助。",
-                    "results": []
-                }
-
-            # Format the response with source links
-            formatted_results = []
-            for result in results:
-                item = {
-                    "title": result["title"],
-                    "relevance_score": 1 - result["distance"],  # Convert distance to relevance
-                    "url": result["url_href"] if result["url_href"] else "",
-                    "url_label": result["url_label"] if result["url_label"] else "",
-                    "image_url": result["image_url"] if result["image_url"] else "",
-                    "tags": result["tags"]
-                }
-                formatted_results.append(item)
-
-            # Get full content for the best match
-            best_match = results[0]
-            kb_item = self.data_processor.get_knowledge_by_id(best_match["id"])
-
-            response_parts = []
-            if kb_item:
-                response_parts.append(kb_item.content)
-                if kb_item.url_href:
-                    response_parts.append(f"\n\n詳細資訊請參考：[{kb_item.url_label or '詳細說明'}]({kb_item.url_href})")
-                if kb_item.image_url:
-                    response_parts.append(f"\n\n相關圖片：{kb_item.image_url}")
-
-            return {
-                "success": True,
-                "message": "".join(response_parts),
-                "results": formatted_results,
-                "primary_source": {
-                    "title": best_match["title"],
-                    "url": best_match["url_href"],
-                    "url_label": best_match["url_label"]
-                }
-            }
-
+            # Repeated queries are served from the LRU cache; deep-copy so callers can't mutate
+            # cached entries, including the nested results lists
+            return copy.deepcopy(self._cached_search_knowledge_base(query, max_results))
         except Exception as e:
             return {
                 "success": False,
@@ -76,6 +110,53 @@ class JTCGAgentFunctions:
                 "results": []
             }
 
+    def _search_knowledge_base(self, query: str, max_results: int) -> Dict[str, Any]:
+        """Run the knowledge base search and format the response (cached per instance)"""
+        results = self.vector_db.search_knowledge(query, n_results=max_results)
+
+        if not results:
+            return {
+                "success": False,
+                "message": "很抱歉，目前無法找到相關的資訊。建議您聯繫我們的客服團隊以獲得進一步協助。",
+                "results": []
+            }
+
+        # Format the response with source links
+        formatted_results = [
+            {
+                "title": result["title"],
+                "relevance_score": 1 - result["distance"],  # Convert distance to relevance
+                "url": result.get("url_href") or "",
+                "url_label": result.get("url_label") or "",
+                "image_url": result.get("image_url") or "",
+                "tags": result["tags"]
+            }
+            for result in results
+        ]
+
+        # Get full content for the best match
+        best_match = results[0]
+        kb_item = self.data_processor.get_knowledge_by_id(best_match["id"])
+
+        response_parts = []
+        if kb_item:
+            response_parts.append(kb_item.content)
+            if kb_item.url_href:
+                response_parts.append(f"\n\n詳細資訊請參考：[{kb_item.url_label or '詳細說明'}]({kb_item.url_href})")
+            if kb_item.image_url:
+                response_parts.append(f"\n\n相關圖片：{kb_item.image_url}")
+
+        return {
+            "success": True,
+            "message": "".join(response_parts),
+            "results": formatted_results,
+            "primary_source": {
+                "title": best_match["title"],
+                "url": best_match["url_href"],
+                "url_label": best_match["url_label"]
+            }
+        }
+
     def search_products(self, query: str, specifications: Optional[Dict] = None, max_results: int = 5) -> Dict[str, Any]:
         """
         Search for products based on user requirements
@@ -90,84 +171,85 @@ class JTCGAgentFunctions:
         """
         try:
             # Enhance query with specifications if provided
-            enhanced_query = query
-            if specifications:
-                spec_parts = []
-                for key, value in specifications.items():
-                    if value:
-                        spec_parts.append(f"{key}: {value}")
-                if spec_parts:
-                    enhanced_query += " " + " ".join(spec_parts)
-
-            results = self.vector_db.search_products(enhanced_query, n_results=max_results)
-
-            if not results:
-                return {
-                    "success": False,
-                    "message": "很抱歉，沒有找到符合您需求的產品。請提供更多資訊，如螢幕尺寸、VESA規格或使用情境，以便我為您推薦合適的產品。",
-                    "products": []
-                }
+            enhanced_query = query + "".join(
+                f" {key}: {value}" for key, value in (specifications or {}).items() if value
+            )
 
-            # Format product results with compatibility info
-            formatted_products = []
-            for result in results:
-                product_info = {
-                    "sku": result["sku"],
-                    "name": result["name"],
-                    "arm_type": result["arm_type"],
-                    "max_size": result["size_max_inch"],
-                    "vesa_options": result["vesa_options"],
-                    "weight_capacity": result["weight_per_arm_kg"],
-                    "desk_thickness": result["desk_thickness_mm"],
-                    "compatibility_notes": result["compatibility_notes"],
-                    "url": result["url"],
-                    "image_url": result["image_url"],
-                    "includes": result["includes"],
-                    "relevance_score": 1 - result["distance"]
-                }
-                formatted_products.append(product_info)
+            # Repeated queries are served from the LRU cache; deep-copy so callers can't mutate
+            # cached entries, including the nested products lists
+            return copy.deepcopy(self._cached_search_products(enhanced_query, max_results))
+        except Exception as e:
+            return {
+                "success": False,
+                "message": "產品搜尋時發生錯誤，請稍後再試或聯繫客服團隊。",
+                "error": str(e),
+                "products": []
+            }
 
-            # Generate response with top recommendations
-            response_parts = ["以下是為您推薦的產品：\n"]
+    def _search_products(self, query: str, max_results: int) -> Dict[str, Any]:
+        """Run the product search for an already-enhanced query and format the response (cached per instance)"""
+        results = self.vector_db.search_products(query, n_results=max_results)
 
-            for i, product in enumerate(formatted_products[:3], 1):
-                response_parts.append(f"\n{i}. **{product['name']}** ({product['sku']})")
+        if not results:
+            return {
+                "success": False,
+                "message": "很抱歉，沒有找到符合您需求的產品。請提供更多資訊，如螢幕尺寸、VESA規格或使用情境，以便我為您推薦合適的產品。",
+                "products": []
+            }
 
-                specs = []
-                if product['max_size']:
-                    specs.append(f"支援至 {product['max_size']} 吋")
-                if product['vesa_options']:
-                    specs.append(f"VESA: {', '.join(product['vesa_options'])}")
-                if product['weight_capacity']:
-                    specs.append(f"承重: {product['weight_capacity']} kg")
+        # Format product results with compatibility info
+        formatted_products = [
+            {
+                "sku": result["sku"],
+                "name": result["name"],
+                "arm_type": result["arm_type"],
+                "max_size": result["size_max_inch"],
+                "vesa_options": result["vesa_options"],
+                "weight_capacity": result["weight_per_arm_kg"],
+                "desk_thickness": result["desk_thickness_mm"],
+                "compatibility_notes": result["compatibility_notes"],
+                "url": result["url"],
+                "image_url": result["image_url"],
+                "includes": result["includes"],
+                "relevance_score": 1 - result["distance"]
+            }
+            for result in results
+        ]
 
-                if specs:
-                    response_parts.append(f" - {', '.join(specs)}")
+        # Generate response with top recommendations
+        response_parts = ["以下是為您推薦的產品：\n"]
+        append = response_parts.append
 
-                if product['compatibility_notes']:
-                    response_parts.append(f"\n   注意事項: {product['compatibility_notes']}")
+        for i, product in enumerate(formatted_products[:3], 1):
+            append(f"\n{i}. **{product['name']}** ({product['sku']})")
 
-                if product['url']:
-                    response_parts.append(f"\n   [查看詳情]({product['url']})")
+            specs = []
+            if product['max_size']:
+                specs.append(f"支援至 {product['max_size']} 吋")
+            if product['vesa_options']:
+                specs.append(f"VESA: {', '.join(product['vesa_options'])}")
+            if product['weight_capacity']:
+                specs.append(f"承重: {product['weight_capacity']} kg")
 
-                response_parts.append("\n")
+            if specs:
+                append(f" - {', '.join(specs)}")
 
-            response_parts.append("\n如需更詳細的建議，請告訴我您的螢幕尺寸、桌面厚度或特殊需求。")
+            if product['compatibility_notes']:
+                append(f"\n   注意事項: {product['compatibility_notes']}")
 
-            return {
-                "success": True,
-                "message": "".join(response_parts),
-                "products": formatted_products,
-                "total_found": len(results)
-            }
+            if product['url']:
+                append(f"\n   [查看詳情]({product['url']})")
 
-        except Exception as e:
-            return {
-                "success": False,
-                "message": "產品搜尋時發生錯誤，請稍後再試或聯繫客服團隊。",
-                "error": str(e),
-                "products": []
-            }
+            append("\n")
+
+        append("\n如需更詳細的建議，請告訴我您的螢幕尺寸、桌面厚度或特殊需求。")
+
+        return {
+            "success": True,
+            "message": "".join(response_parts),
+            "products": formatted_products,
+            "total_found": len(results)
+        }
 
     def lookup_user_orders(self, user_id: str) -> Dict[str, Any]:
         """
@@ -189,56 +271,35 @@ class JTCGAgentFunctions:
                     "orders": []
                 }
 
-            # Format orders for display
-            formatted_orders = []
-            for order in orders:
-                order_info = {
-                    "order_id": order.order_id,
-                    "placed_at": order.placed_at,
-                    "status": order.status,
-                    "carrier": order.carrier,
-                    "tracking": order.tracking,
-                    "eta": order.eta,
-                    "items": order.items,
-                    "shipping_address": order.shipping_address,
-                    "contact_phone": order.contact_phone,
-                    "order_url": order.order_url
-                }
-                formatted_orders.append(order_info)
-
-            # Generate response
+            # Build the response
             response_parts = [f"找到用戶 {user_id} 的 {len(orders)} 筆訂單：\n"]
+            append = response_parts.append
 
-            for i, order in enumerate(formatted_orders, 1):
-                status_display = {
-                    "processing": "處理中",
-                    "shipped": "已出貨",
-                    "in_transit": "運送中",
-                    "delivered": "已送達"
-                }.get(order["status"], order["status"])
+            for i, order in enumerate(orders, 1):
+                status_display = STATUS_DISPLAY.get(order.status, order.status)
 
-                response_parts.append(f"\n{i}. 訂單 {order['order_id']}")
-                response_parts.append(f" - 狀態: {status_display}")
+                append(f"\n{i}. 訂單 {order.order_id}")
+                append(f" - 狀態: {status_display}")
 
-                if order["carrier"] and order["tracking"]:
-                    response_parts.append(f" - 物流: {order['carrier']} ({order['tracking']})")
+                if order.carrier and order.tracking:
+                    append(f" - 物流: {order.carrier} ({order.tracking})")
 
-                if order["eta"]:
-                    response_parts.append(f" - 預計到貨: {order['eta']}")
+                if order.eta:
+                    append(f" - 預計到貨: {order.eta}")
 
-                response_parts.append(f" - 商品: {', '.join([item['name'] for item in order['items']])}")
+                append(f" - 商品: {', '.join(item['name'] for item in order.items)}")
 
-                if order["order_url"]:
-                    response_parts.append(f" - [查看訂單詳情]({order['order_url']})")
+                if order.order_url:
+                    append(f" - [查看訂單詳情]({order.order_url})")
 
-                response_parts.append("\n")
+                append("\n")
 
-            response_parts.append("如需查詢特定訂單的詳細資訊，請提供訂單編號。")
+            append("如需查詢特定訂單的詳細資訊，請提供訂單編號。")
 
             return {
                 "success": True,
                 "message": "".join(response_parts),
-                "orders": formatted_orders,
+                "orders": [_order_to_dict(order) for order in orders],
                 "user_id": user_id,
                 "total_orders": len(orders)
             }
@@ -272,49 +333,28 @@ class JTCGAgentFunctions:
                 }
 
             # Format order details
-            status_display = {
-                "processing": "處理中",
-                "shipped": "已出貨",
-                "in_transit": "運送中",
-                "delivered": "已送達"
-            }.get(order.status, order.status)
-
-            response_parts = [f"訂單 {order.order_id} 詳細資訊：\n"]
-            response_parts.append(f"狀態: {status_display}")
-            response_parts.append(f"下單時間: {order.placed_at}")
-
-            if order.carrier:
-                response_parts.append(f"物流商: {order.carrier}")
-            if order.tracking:
-                response_parts.append(f"追蹤號碼: {order.tracking}")
-            if order.eta:
-                response_parts.append(f"預計到貨: {order.eta}")
-
-            response_parts.append(f"\n購買商品:")
-            for item in order.items:
-                response_parts.append(f"- {item['name']} x{item['qty']}")
-
-            response_parts.append(f"\n配送地址: {order.shipping_address}")
-            response_parts.append(f"聯絡電話: {order.contact_phone}")
-
-            if order.order_url:
-                response_parts.append(f"\n[查看完整訂單]({order.order_url})")
+            status_display = STATUS_DISPLAY.get(order.status, order.status)
+
+            items = "".join(f"\n- {item['name']} x{item['qty']}" for item in order.items)
+            order_link = f"\n\n[查看完整訂單]({order.order_url})" if order.order_url else ""
+
+            message = (
+                f"訂單 {order.order_id} 詳細資訊：\n"
+                f"\n狀態: {status_display}"
+                f"\n下單時間: {order.placed_at}"
+                f"{_optional_line('物流商', order.carrier)}"
+                f"{_optional_line('追蹤號碼', order.tracking)}"
+                f"{_optional_line('預計到貨', order.eta)}"
+                f"\n\n購買商品:{items}"
+                f"\n\n配送地址: {order.shipping_address}"
+                f"\n聯絡電話: {order.contact_phone}"
+                f"{order_link}"
+            )
 
             return {
                 "success": True,
-                "message": "\n".join(response_parts),
-                "order": {
-                    "order_id": order.order_id,
-                    "status": order.status,
-                    "placed_at": order.placed_at,
-                    "carrier": order.carrier,
-                    "tracking": order.tracking,
-                    "eta": order.eta,
-                    "items": order.items,
-                    "shipping_address": order.shipping_address,
-                    "contact_phone": order.contact_phone,
-                    "order_url": order.order_url
-                }
+                "message": message,
+                "order": _order_to_dict(order)
             }
 
         except Exception as e:
@@ -340,19 +380,18 @@ class JTCGAgentFunctions:
         try:
             # Generate conversation ID if not provided
             if not conversation_id:
-                conversation_id = f"JTCG-CHAT-{str(uuid.uuid4())[:8]}"
+                conversation_id = f"JTCG-CHAT-{secrets.token_hex(4)}"
 
             # Validate email format
-            email_pattern = re.compile(r"^[^\s@]+@[^\s@]+\.[^\s@]+$")
-            if not email_pattern.match(email or ""):
+            if not EMAIL_RE.fullmatch(email or ""):
                 return {
                     "success": False,
                     "message": "請提供有效的Email地址以便我們為您轉接真人客服。",
                     "conversation_id": conversation_id
                 }
 
-            # Call the handover function
-            result = handover_simple(conversation_id, email, conversation_summary)
+            # Call the handover function; the email was already validated above
+            result = handover_simple(conversation_id, email, conversation_summary, validate_email=False)
 
             if result == "已為您轉接真人":
                 return {
@@ -388,25 +427,19 @@ class JTCGAgentFunctions:
         """
         message_lower = user_message.lower()
 
-        # Order-related keywords
-        order_keywords = ['訂單', '物流', '追蹤', '配送', '出貨', '到貨', 'order', 'tracking', 'shipping', 'delivery']
-        if any(keyword in message_lower for keyword in order_keywords):
-            return 'order'
-
-        # Product search keywords
-        product_keywords = ['產品', '臂架', '支架', '螢幕', '推薦', '規格', '尺寸', 'vesa', 'arm', 'monitor', 'product']
-        if any(keyword in message_lower for keyword in product_keywords):
-            return 'product'
-
-        # Human handover keywords
-        handover_keywords = ['真人', '客服', '人工', '轉接', '協助', 'human', 'help', 'support', 'agent']
-        if any(keyword in message_lower for keyword in handover_keywords):
-            return 'handover'
+        if self._intent_automaton is None:
+            for intent, pattern in INTENT_PATTERNS:
+                if pattern.search(message_lower):
+                    return intent
+            return 'general'
 
-        # FAQ keywords
-        faq_keywords = ['政策', '退換貨', '保固', '發票', '運費', '付款', 'policy', 'return', 'warranty', 'payment']
-        if any(keyword in message_lower for keyword in faq_keywords):
-            return 'faq'
+        # Single pass over the message; keep the highest-priority intent seen
+        best = None
+        for _, (priority, intent) in self._intent_automaton.iter(message_lower):
+            if priority == 0:
+                return intent
+            if best is None or priority < best[0]:
+                best = (priority, intent)
 
         # Default to general for broader questions
-        return 'general'
\ No newline at end of file
+        return best[1] if best else 'general'
@@ -1,23 +1,40 @@
-import pandas as pd
-import json
-from typing import Dict, List, Any, Optional
-from pydantic import BaseModel, Field
-
-class KnowledgeItem(BaseModel):
+import csv
+import os
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Any, Optional, Tuple
+from dataclasses import dataclass, field
+
+def read_conversations(json_path: str) -> List[List[Dict]]:
+    """Parse a conversations JSON file once per process and share the result
+
+    The same list is returned to every caller, so treat it as read-only.
+    """
+    return _read_conversations(os.path.abspath(json_path))
+
+@lru_cache(maxsize=4)
+def _read_conversations(json_path: str) -> List[List[Dict]]:
+    with open(json_path, 'rb') as f:
+        return orjson.loads(f.read())
+
+@dataclass(slots=True)
+class KnowledgeItem:
     id: str
     title: str
     content: str
     url_label: str = ""
     url_href: str = ""
     image_url: str = ""
-    tags: List[str] = Field(default_factory=list)
+    tags: List[str] = field(default_factory=list)
 
-class Product(BaseModel):
+@dataclass(slots=True)
+class Product:
     sku: str
     name: str
     arm_type: str = ""
     size_max_inch: str = ""
-    vesa_options: List[str] = Field(default_factory=list)
+    vesa_options: List[str] = field(default_factory=list)
     weight_per_arm_kg: str = ""
     desk_thickness_mm: str = ""
     rotation: str = ""
@@ -29,16 +46,17 @@ class Product(BaseModel):
     image_url: str = ""
     reach_mm: str = ""
     tray_size_inch: str = ""
-    includes: List[str] = Field(default_factory=list)
+    includes: List[str] = field(default_factory=list)
 
-class Order(BaseModel):
+@dataclass(slots=True)
+class Order:
     order_id: str
     placed_at: str
     status: str
     carrier: str = ""
     tracking: str = ""
     eta: str = ""
-    items: List[Dict[str, Any]] = Field(default_factory=list)
+    items: List[Dict[str, Any]] = field(default_factory=list)
     shipping_address: str = ""
     contact_phone: str = ""
     order_url: str = ""
@@ -50,90 +68,84 @@ class DataProcessor:
         self.orders_db: Dict[str, List[Order]] = {}
         self.conversations: List[List[Dict]] = []
 
-    def load_knowledge_base(self, csv_path: str) -> List[KnowledgeItem]:
-        """Load and parse the knowledge base CSV file"""
-        df = pd.read_csv(csv_path)
+        # Lookup indexes built at load time
+        self._kb_by_id: Dict[str, KnowledgeItem] = {}
+        self._product_by_sku: Dict[str, Product] = {}
+        self._order_by_id: Dict[str, Order] = {}
 
-        knowledge_items = []
-        for _, row in df.iterrows():
-            # Handle tags - extract from columns that start with 'tags/'
-            tags = []
-            for col in df.columns:
-                if col.startswith('tags/') and pd.notna(row[col]):
-                    tags.append(row[col])
+    @staticmethod
+    def _read_csv(csv_path: str) -> Tuple[List[str], List[Dict[str, str]]]:
+        """Read a CSV file into its header and a list of row dicts (empty cells as "")"""
+        with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.DictReader(f, restval="")
+            rows = list(reader)
+        return list(reader.fieldnames or []), rows
 
-            # Handle URLs
-            url_label = row.get('urls/0/label', '') if pd.notna(row.get('urls/0/label')) else ''
-            url_href = row.get('urls/0/href', '') if pd.notna(row.get('urls/0/href')) else ''
+    def load_knowledge_base(self, csv_path: str) -> List[KnowledgeItem]:
+        """Load and parse the knowledge base CSV file"""
+        header, rows = self._read_csv(csv_path)
 
-            # Handle images
-            image_url = row.get('images/0', '') if pd.notna(row.get('images/0')) else ''
+        # Handle tags - extract from columns that start with 'tags/'
+        tag_cols = [col for col in header if col.startswith('tags/')]
 
-            item = KnowledgeItem(
+        knowledge_items = [
+            KnowledgeItem(
                 id=row['id'],
                 title=row['title'],
                 content=row['content'],
-                url_label=url_label,
-                url_href=url_href,
-                image_url=image_url,
-                tags=tags
+                url_label=row.get('urls/0/label', ''),
+                url_href=row.get('urls/0/href', ''),
+                image_url=row.get('images/0', ''),
+                tags=[row[col] for col in tag_cols if row[col]]
             )
-            knowledge_items.append(item)
+            for row in rows
+        ]
 
         self.knowledge_base = knowledge_items
+        # Iterate in reverse so the first item wins on duplicate IDs
+        self._kb_by_id = {item.id: item for item in reversed(knowledge_items)}
         return knowledge_items
 
     def load_products(self, csv_path: str) -> List[Product]:
         """Load and parse the products CSV file"""
-        df = pd.read_csv(csv_path)
+        header, rows = self._read_csv(csv_path)
 
-        products = []
-        for _, row in df.iterrows():
-            # Handle VESA options
-            vesa_options = []
-            for col in df.columns:
-                if col.startswith('specs/vesa/') and pd.notna(row[col]):
-                    vesa_options.append(row[col])
-
-            # Handle includes
-            includes = []
-            for col in df.columns:
-                if col.startswith('specs/includes/') and pd.notna(row[col]):
-                    includes.append(row[col])
-
-            # Helper function to get safe value
-            def safe_get(column, default=""):
-                value = row.get(column, default) if pd.notna(row.get(column)) else default
-                return str(value) if value is not None else default
+        # Handle VESA options and includes
+        vesa_cols = [col for col in header if col.startswith('specs/vesa/')]
+        includes_cols = [col for col in header if col.startswith('specs/includes/')]
 
+        products = []
+        for row in rows:
+            get = row.get
             product = Product(
                 sku=row['sku'],
                 name=row['name'],
-                arm_type=safe_get('specs/arm_type'),
-                size_max_inch=str(safe_get('specs/size_max_inch')),
-                vesa_options=vesa_options,
-                weight_per_arm_kg=safe_get('specs/weight_per_arm_kg'),
-                desk_thickness_mm=safe_get('specs/desk_thickness_mm'),
-                rotation=safe_get('specs/rotation'),
-                tilt=safe_get('specs/tilt'),
-                swivel=safe_get('specs/swivel'),
-                usb_hub=bool(safe_get('specs/usb_hub')),
-                compatibility_notes=safe_get('compatibility_notes'),
-                url=safe_get('url'),
-                image_url=safe_get('images/0'),
-                reach_mm=safe_get('specs/reach_mm'),
-                tray_size_inch=safe_get('specs/tray_size_inch'),
-                includes=includes
+                arm_type=get('specs/arm_type', ''),
+                size_max_inch=get('specs/size_max_inch', ''),
+                vesa_options=[row[col] for col in vesa_cols if row[col]],
+                weight_per_arm_kg=get('specs/weight_per_arm_kg', ''),
+                desk_thickness_mm=get('specs/desk_thickness_mm', ''),
+                rotation=get('specs/rotation', ''),
+                tilt=get('specs/tilt', ''),
+                swivel=get('specs/swivel', ''),
+                usb_hub=get('specs/usb_hub', '').strip().lower() == 'true',
+                compatibility_notes=get('compatibility_notes', ''),
+                url=get('url', ''),
+                image_url=get('images/0', ''),
+                reach_mm=get('specs/reach_mm', ''),
+                tray_size_inch=get('specs/tray_size_inch', ''),
+                includes=[row[col] for col in includes_cols if row[col]]
             )
             products.append(product)
 
         self.products = products
+        self._product_by_sku = {product.sku: product for product in reversed(products)}
         return products
 
     def load_orders_from_json(self, json_path: str) -> Dict[str, List[Order]]:
         """Load orders from a JSON file"""
-        with open(json_path, 'r', encoding='utf-8') as f:
-            orders_data = json.load(f)
+        with open(json_path, 'rb') as f:
+            orders_data = orjson.loads(f.read())
 
         # Parse orders into Order objects
         parsed_orders = {}
@@ -142,13 +154,14 @@ class DataProcessor:
         for user_id, user_data in orders_db.items():
             user_orders = []
             for order_data in user_data["orders"]:
+                get = order_data.get
                 order = Order(
                     order_id=order_data["order_id"],
                     placed_at=order_data["placed_at"],
                     status=order_data["status"],
-                    carrier=order_data.get("carrier", "") or "",
-                    tracking=order_data.get("tracking", "") or "",
-                    eta=order_data.get("eta", "") or "",
+                    carrier=get("carrier") or "",
+                    tracking=get("tracking") or "",
+                    eta=get("eta") or "",
                     items=order_data["items"],
                     shipping_address=order_data["shipping_address"],
                     contact_phone=order_data["contact_phone"],
@@ -158,36 +171,42 @@ class DataProcessor:
             parsed_orders[user_id] = user_orders
 
         self.orders_db = parsed_orders
+        self._order_by_id = {
+            order.order_id: order
+            for user_orders in reversed(list(parsed_orders.values()))
+            for order in reversed(user_orders)
+        }
         return parsed_orders
 
     def load_conversations(self, json_path: str) -> List[List[Dict]]:
         """Load test conversations from JSON file"""
-        with open(json_path, 'r', encoding='utf-8') as f:
-            conversations = json.load(f)
+        conversations = read_conversations(json_path)
 
         self.conversations = conversations
         return conversations
 
     def load_all_data(self, knowledge_csv: str, products_csv: str, orders_json: str, conversations_json: str):
         """Load all data sources from specified paths"""
-        self.load_knowledge_base(knowledge_csv)
-        self.load_products(products_csv)
-        self.load_orders_from_json(orders_json)
-        self.load_conversations(conversations_json)
+        # The loaders read independent files and each writes only its own attributes,
+        # so they can overlap their file I/O on a small thread pool
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [
+                executor.submit(self.load_knowledge_base, knowledge_csv),
+                executor.submit(self.load_products, products_csv),
+                executor.submit(self.load_orders_from_json, orders_json),
+                executor.submit(self.load_conversations, conversations_json)
+            ]
+            # Re-raise the first loader error, if any
+            for future in futures:
+                future.result()
 
     def get_knowledge_by_id(self, knowledge_id: str) -> Optional[KnowledgeItem]:
         """Get knowledge item by ID"""
-        for item in self.knowledge_base:
-            if item.id == knowledge_id:
-                return item
-        return None
+        return self._kb_by_id.get(knowledge_id)
 
     def get_product_by_sku(self, sku: str) -> Optional[Product]:
         """Get product by SKU"""
-        for product in self.products:
-            if product.sku == sku:
-                return product
-        return None
+        return self._product_by_sku.get(sku)
 
     def get_orders_by_user_id(self, user_id: str) -> List[Order]:
         """Get orders for a specific user"""
@@ -195,8 +214,4 @@ class DataProcessor:
 
     def get_order_by_id(self, order_id: str) -> Optional[Order]:
         """Get specific order by order ID"""
-        for user_orders in self.orders_db.values():
-            for order in user_orders:
-                if order.order_id == order_id:
-                    return order
-        return None
\ No newline at end of file
+        return self._order_by_id.get(order_id)
\ No newline at end of file
@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 import re
 
-EMAIL_RE = re.compile(r"^[^\s@]+@[^\s@]+\.[^\s@]+$")
+# 以 \A…\Z 錨定整個字串，match / search / fullmatch 結果一致（\Z 不接受結尾換行）
+EMAIL_RE = re.compile(r"\A[^\s@]+@[^\s@]+\.[^\s@]+\Z")
 
-def handover_simple(conversation_id: str, email: str, summary: str, simulate_fail: bool = False) -> str:
+def handover_simple(conversation_id: str, email: str, summary: str, simulate_fail: bool = False,
+                    validate_email: bool = True) -> str:
     """
     簡易轉接真人（模擬版）
     Args:
@@ -11,12 +13,13 @@ def handover_simple(conversation_id: str, email: str, summary: str, simulate_fai
         email: 使用者 Email（此版僅做基本格式檢查）
         summary: 對話摘要（會送入 mock API；此處不做實際保存）
         simulate_fail: 設為 True 可強制模擬 API 失敗
+        validate_email: 呼叫端已用 EMAIL_RE 驗證過時可設為 False，略過重複檢查
     Returns:
         str: 成功 -> "已為您轉接真人"
              失敗 -> "轉接真人時發生錯誤，請聯繫技術團隊協助"
     """
     # 基本 Email 檢查（不通過就視為失敗）
-    if not EMAIL_RE.match(email or ""):
+    if validate_email and not EMAIL_RE.fullmatch(email or ""):
         return "轉接真人時發生錯誤，請聯繫技術團隊協助"
 
     payload = {
@@ -1,19 +1,96 @@
 #!/usr/bin/env python3
 
+import asyncio
 import os
-from typing import Dict, Any
-from agents import Agent, Runner, function_tool
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Final, Optional
+from agents import Agent, OpenAIProvider, RunConfig, Runner, function_tool, set_tracing_export_api_key
 from data_processor import DataProcessor
 from vector_db import VectorDB
 from agent_functions import JTCGAgentFunctions
+from semantic_cache import SemanticCache
+
+# Start of the reply chat() returns when the agent run itself fails
+CHAT_ERROR_PREFIX: Final[str] = "很抱歉，處理您的請求時發生錯誤。"
+
+# Replies to messages with an order id, user_id or email are specific to that account, but the
+# message embeds almost identically to the same question about another account, so they are
+# never served from or stored in the response cache
+PERSONAL_DATA_RE = re.compile(r"JTCG-\d{6}-\d+|u_\d+|[^\s@]+@[^\s@]+\.[^\s@]+", re.IGNORECASE)
+# Intents whose replies depend on the user's account or an open handover
+UNCACHEABLE_INTENTS = frozenset({"order", "handover"})
+
+# System prompt for the CRM agent, built once at import
+SYSTEM_INSTRUCTIONS: Final[str] = """你是 JTCG Shop 的客服人員。JTCG Shop 專注於工作空間體驗與周邊配件的選品與設計，包含螢幕臂、壁掛支架、走線收納與安裝配件等。
+
+品牌主張：Better Desk, Better Focus.
+核心特色：相容性清楚、安裝不踩雷、售後好溝通。
+
+重要：絕對不要使用以下 AI 機器人用語：
+禁止使用：「簡短回答」「補充說明」「詳細說明」「總結」
+禁止使用：「讓我為您...」「我將為您...」等助理語言
+禁止回答超出職責範圍的內容，比如: 政治問題、數學問題、程式問題、情感問題
+
+你的回應風格：
+- 自然對話，直接回答，像真正的客服人員
+- 不使用任何 AI 助理的用語格式
+- 先直答、再補充，避免冗長
+- 語系跟隨使用者最新訊息（繁體/簡體中文一致）
+- 有來源就明確附上連結
+
+良好回應範例：
+用戶：「請問你們的退換貨政策是什麼？」
+正確回應：「我們提供 7 天鑑賞期（含例假日），商品需保持全新、完整包裝與配件。若非瑕疵退換貨，可能需自行負擔來回運費。
+
+詳細條款請參考：https://example.com/jtcg/policies/returns
+
+需要我協助查詢您的訂單是否可以退換嗎？」
+
+錯誤回應：「簡短回答：退換貨政策如下... 補充說明：...」
+
+用戶：「保固多久？」
+正確回應：「保固期間依商品而異，一般臂架產品享有 1 年保固。需要提供訂單編號或發票資訊申請維修。
+
+保固說明請看：https://example.com/jtcg/policies/warranty
+
+要我幫您查詢特定商品的保固狀況嗎？」
+
+錯誤回應：「簡短回答：保固期限依商品而異... 詳細說明請參考...」
+
+用戶：「有雙螢幕臂推薦嗎？」
+正確回應：「推薦您這款 JTCG 雙螢幕氣壓臂 Pro，支援至 32 吋螢幕，VESA 75x75 和 100x100 都能裝。承重 2-9kg，適合桌板厚度 10-85mm。
+
+想了解您的螢幕尺寸和桌面情況嗎？這樣我能給您更精準的建議。」
+
+核心功能範圍：
+A. FAQ 智能回覆 - 使用 search_knowledge_base 工具
+B. 產品探索與建議 - 使用 search_products 工具
+C. 訂單服務查詢 - 使用 lookup_user_orders 和 lookup_order_details 工具
+D. 真人客服轉接 - 使用 handover_to_human 工具
+
+互動原則：
+- 理解使用者最新意圖，必要時簡短澄清
+- 先解決當前問題，再適度補充
+- 必要資訊就近索取（user_id、Email等）
+- 提供可立即執行的下一步引導
+
+記住：以自然、專業、貼心的方式回應，就像真正的 JTCG Shop 客服人員。"""
 
 class JTCGCRMAgent:
-    def __init__(self, openai_api_key: str):
+    def __init__(self, openai_api_key: str, semantic_cache: Optional[bool] = None):
         # Initialize data components
         self.data_processor = DataProcessor()
         self.vector_db = VectorDB()
         self.agent_functions = None
         self.agent = None
+        self.run_config = None
+
+        # Reuse responses for semantically duplicate single-turn messages; opt in with
+        # JTCG_SEMANTIC_CACHE=1 (or semantic_cache=True)
+        if semantic_cache is None:
+            semantic_cache = os.getenv("JTCG_SEMANTIC_CACHE", "") == "1"
+        self.response_cache = SemanticCache() if semantic_cache else None
 
         # Load data
         self._load_data()
@@ -27,22 +104,34 @@ class JTCGCRMAgent:
     def _load_data(self):
         """Load all data sources"""
         print("Loading JTCG data...")
-        self.data_processor.load_all_data(
-            knowledge_csv="ref_data/ai-eng-test-sample-knowledges.csv",
-            products_csv="ref_data/ai-eng-test-sample-products.csv",
-            orders_json="ref_data/orders.json",
-            conversations_json="ref_data/ai-eng-test-sample-conversations.json"
-        )
-
-        # Initialize vector database
-        self.vector_db.initialize_with_data(self.data_processor)
+        processor = self.data_processor
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            catalog = [
+                executor.submit(processor.load_knowledge_base, "ref_data/ai-eng-test-sample-knowledges.csv"),
+                executor.submit(processor.load_products, "ref_data/ai-eng-test-sample-products.csv")
+            ]
+            records = [
+                executor.submit(processor.load_orders_from_json, "ref_data/orders.json"),
+                executor.submit(processor.load_conversations, "ref_data/ai-eng-test-sample-conversations.json")
+            ]
+            for future in catalog:
+                future.result()
+
+            # The vector database only needs the knowledge base and products,
+            # so build it while orders and conversations are still loading
+            self.vector_db.initialize_with_data(processor)
+
+            for future in records:
+                future.result()
         print("Data loading complete!")
 
     def _setup_agent(self, openai_api_key: str):
         """Setup the OpenAI Agent with function tools"""
 
-        # Set OpenAI API key
-        os.environ["OPENAI_API_KEY"] = openai_api_key
+        # Hand the API key to this agent's model provider instead of the process environment;
+        # the provider also keeps one client (and connection pool) for every run
+        self.run_config = RunConfig(model_provider=OpenAIProvider(api_key=openai_api_key))
+        set_tracing_export_api_key(openai_api_key)
 
         # Get model from environment or use default
         model_name = os.getenv("OPENAI_MODEL", "gpt-4")
@@ -84,60 +173,7 @@ class JTCGCRMAgent:
 
     def _get_system_instructions(self) -> str:
         """Get the system instructions for the agent"""
-        return """你是 JTCG Shop 的客服人員。JTCG Shop 專注於工作空間體驗與周邊配件的選品與設計，包含螢幕臂、壁掛支架、走線收納與安裝配件等。
-
-品牌主張：Better Desk, Better Focus.
-核心特色：相容性清楚、安裝不踩雷、售後好溝通。
-
-重要：絕對不要使用以下 AI 機器人用語：
-禁止使用：「簡短回答」「補充說明」「詳細說明」「總結」
-禁止使用：「讓我為您...」「我將為您...」等助理語言
-禁止回答超出職責範圍的內容，比如: 政治問題、數學問題、程式問題、情感問題
-
-你的回應風格：
-- 自然對話，直接回答，像真正的客服人員
-- 不使用任何 AI 助理的用語格式
-- 先直答、再補充，避免冗長
-- 語系跟隨使用者最新訊息（繁體/簡體中文一致）
-- 有來源就明確附上連結
-
-良好回應範例：
-用戶：「請問你們的退換貨政策是什麼？」
-正確回應：「我們提供 7 天鑑賞期（含例假日），商品需保持全新、完整包裝與配件。若非瑕疵退換貨，可能需自行負擔來回運費。
-
-詳細條款請參考：https://example.com/jtcg/policies/returns
-
-需要我協助查詢您的訂單是否可以退換嗎？」
-
-錯誤回應：「簡短回答：退換貨政策如下... 補充說明：...」
-
-用戶：「保固多久？」
-正確回應：「保固期間依商品而異，一般臂架產品享有 1 年保固。需要提供訂單編號或發票資訊申請維修。
-
-保固說明請看：https://example.com/jtcg/policies/warranty
-
-要我幫您查詢特定商品的保固狀況嗎？」
-
-錯誤回應：「簡短回答：保固期限依商品而異... 詳細說明請參考...」
-
-用戶：「有雙螢幕臂推薦嗎？」
-正確回應：「推薦您這款 JTCG 雙螢幕氣壓臂 Pro，支援至 32 吋螢幕，VESA 75x75 和 100x100 都能裝。承重 2-9kg，適合桌板厚度 10-85mm。
-
-想了解您的螢幕尺寸和桌面情況嗎？這樣我能給您更精準的建議。」
-
-核心功能範圍：
-A. FAQ 智能回覆 - 使用 search_knowledge_base 工具
-B. 產品探索與建議 - 使用 search_products 工具
-C. 訂單服務查詢 - 使用 lookup_user_orders 和 lookup_order_details 工具
-D. 真人客服轉接 - 使用 handover_to_human 工具
-
-互動原則：
-- 理解使用者最新意圖，必要時簡短澄清
-- 先解決當前問題，再適度補充
-- 必要資訊就近索取（user_id、Email等）
-- 提供可立即執行的下一步引導
-
-記住：以自然、專業、貼心的方式回應，就像真正的 JTCG Shop 客服人員。"""
+        return SYSTEM_INSTRUCTIONS
 
     def chat(self, message: str, conversation_input=None) -> str:
         """
@@ -150,26 +186,56 @@ D. 真人客服轉接 - 使用 handover_to_human 工具
         Returns:
             Agent's response
         """
+        # Blocking wrapper around achat, reusing this thread's event loop like Runner.run_sync
+        return asyncio.get_event_loop().run_until_complete(self.achat(message, conversation_input))
+
+    async def achat(self, message: str, conversation_input=None) -> str:
+        """Async version of chat, so many conversations can share one event loop"""
         try:
             # If conversation_input is provided, use it directly (it includes history)
             if conversation_input is not None:
                 # conversation_input already includes the history and current message
-                result = Runner.run_sync(self.agent, conversation_input)
+                result = await Runner.run(self.agent, conversation_input, run_config=self.run_config)
                 return result.final_output
             else:
                 # Single turn conversation
                 # Detect intent to provide context
                 intent = self.agent_functions.detect_intent(message)
 
+                # Serve semantically duplicate messages from the cache (multi-turn input is
+                # context-dependent, so only single turns are cached)
+                message_embedding = None
+                if self.response_cache is not None and self._cacheable(message, intent):
+                    message_embedding = self._embed_for_cache(message)
+                if message_embedding is not None:
+                    hit = self.response_cache.lookup(message_embedding)
+                    if hit:
+                        return hit.response
+
                 # Add intent context to the message
                 contextual_message = f"[用戶意圖: {intent}] {message}"
 
-                # Run the agent using Runner.run_sync
-                result = Runner.run_sync(self.agent, contextual_message)
+                # Run the agent
+                result = await Runner.run(self.agent, contextual_message, run_config=self.run_config)
+
+                if message_embedding is not None:
+                    self.response_cache.insert(message_embedding, message, result.final_output)
                 return result.final_output
 
         except Exception as e:
-            return f"很抱歉，處理您的請求時發生錯誤。請稍後再試或聯繫我們的客服團隊。錯誤信息：{str(e)}"
+            return f"{CHAT_ERROR_PREFIX}請稍後再試或聯繫我們的客服團隊。錯誤信息：{str(e)}"
+
+    @staticmethod
+    def _cacheable(message: str, intent: str) -> bool:
+        """Whether a single-turn reply may be shared with other users through the response cache"""
+        return intent not in UNCACHEABLE_INTENTS and not PERSONAL_DATA_RE.search(message)
+
+    def _embed_for_cache(self, message: str):
+        """Embed a message for the response cache; a cache failure must never block a reply"""
+        try:
+            return self.vector_db.embed(message)
+        except Exception:
+            return None
 
     def reset_conversation(self):
         """Reset the conversation state"""
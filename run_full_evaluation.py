@@ -2,40 +2,74 @@
 
 # Standard library imports
 import argparse
+import asyncio
 import csv
-import json
+import hashlib
 import logging
 import os
+import re
+import sqlite3
+import threading
 import time
 from datetime import datetime
-from typing import List, Dict, Any
+from functools import lru_cache
+from typing import List, Dict, Any, Optional
 
 # Third-party imports
+import orjson
 from dotenv import load_dotenv
+from openai import OpenAI, RateLimitError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+# pydantic (used by the Agents SDK for structured output) needs typing_extensions.TypedDict before 3.12
+from typing_extensions import TypedDict
 
 # Local imports
-from agents import Agent, Runner
-from test_conversations import ConversationTester
+from agents import Agent, AgentOutputSchema, ModelSettings, OpenAIProvider, RunConfig, Runner, set_tracing_export_api_key
+from jtcg_agent import CHAT_ERROR_PREFIX
+from semantic_cache import embedding_cache
+from test_conversations import CSV_ESCAPES, DEFAULT_AGENT_WORKERS, ConversationResult, ConversationTester
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class LLMJudgeEvaluator:
-    """LLM Judge to evaluate agent responses"""
-
-    def __init__(self, openai_api_key: str):
-        os.environ["OPENAI_API_KEY"] = openai_api_key
-
-        # Create judge agent
-        self.judge_agent = Agent(
-            name="JTCG_Response_Judge",
-            instructions=self._get_judge_instructions(),
-            model=os.getenv("OPENAI_MODEL", "gpt-4")
-        )
-
-    def _get_judge_instructions(self) -> str:
-        return  """
+# Default number of concurrent LLM judge requests (override with JUDGE_WORKERS or --workers)
+DEFAULT_JUDGE_WORKERS = 16
+
+# Seconds between status checks while an OpenAI Batch job is running
+BATCH_POLL_INTERVAL = 30
+BATCH_TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+EVALUATION_FIELDNAMES = [
+    "conversation_id",
+    "user_message",
+    "agent_response",
+    "response_time",
+    "success",
+    "error",
+    "within_scope",  # LLM Judge evaluation
+    "correct_content",  # LLM Judge evaluation
+    "reasoning",  # LLM Judge reasoning
+    "brand_voice",
+    "has_source_links",
+    "actionable_next_steps",
+    "overall_rating",
+    "manual_review_notes",
+    # Added last, so files from before it keep the same column positions
+    "judge_error"  # LLM Judge failed; the two verdict columns are left empty
+]
+
+# Columns a file must have for EvaluationCSVWriter to resume it
+RESUME_FIELDNAMES = ("conversation_id", "success", "response_time", "within_scope", "correct_content",
+                     "has_source_links")
+
+# Bulky text fields cleared from a row once it has been written out
+TRANSCRIPT_FIELDS = ("user_message", "agent_response", "chat_history", "reasoning")
+
+# System instructions for the judge agent. Kept static (no ids or dates) and sent
+# before the per-conversation prompt, so with the few-shot examples the shared
+# prefix stays over the 1024 tokens OpenAI needs to serve it from its prompt cache
+JUDGE_INSTRUCTIONS = """
                 你是 JTCG Shop 客服回應評估專家。你的任務是評估 AI 客服的回應品質。 https://example.com 是JTCG的品牌網站。
 
                 JTCG Shop 服務範圍：
@@ -59,13 +93,33 @@ class LLMJudgeEvaluator:
                 - 是否提供可行的下一步建議
                 - 是否避免編造不存在的資訊
 
+                評估範例（僅供參考評分標準）：
+
+                範例 1：
+                User: 我上週買的螢幕臂還沒到，可以幫我查一下嗎？
+                JTCG Agent: 沒問題！請提供您的訂單編號（order_id）或會員編號（user_id），我馬上為您查詢出貨與物流狀態。
+                評估：{"within_scope": true, "correct_content": true, "reasoning": "訂單查詢屬服務範圍；在缺少 order_id / user_id 時正確地先向用戶索取，沒有猜測訂單狀態"}
+
+                範例 2：
+                User: 你們的螢幕臂保固多久？
+                JTCG Agent: 所有產品皆享有終身保固，任何損壞都可以免費換新。
+                評估：{"within_scope": true, "correct_content": false, "reasoning": "保固屬 FAQ 範圍，但『終身保固、任何損壞免費換新』與官方臂架類 1 年有限保固、人為損壞不在保固內的政策不符，也未附上保固政策連結"}
+
+                範例 3：
+                User: 我想找真人客服。
+                JTCG Agent: 好的，為了轉接真人客服，請先提供您的 email，我們會完成驗證後由專人與您聯繫。
+                評估：{"within_scope": true, "correct_content": true, "reasoning": "真人客服轉接屬服務範圍；依流程先要求 email 驗證，並清楚說明下一步"}
+
+                範例 4：
+                User: 我的螢幕是 VESA 100x100，可以用你們的支架嗎？
+                JTCG Agent: 可以的，我們的支架都支援所有尺寸與重量的螢幕。
+                評估：{"within_scope": true, "correct_content": false, "reasoning": "產品相容性屬服務範圍，但未確認螢幕重量與尺寸限制就宣稱全部相容，也未提供產品頁連結，內容不完整且可能錯誤"}
+
                 請以 JSON 格式回應：{"within_scope": true/false, "correct_content": true/false, "reasoning": "評估理由"}
                 """
 
-    def evaluate_response(self, chat_history: str) -> Dict[str, Any]:
-        """Evaluate a conversation based on complete chat history"""
-        try:
-            evaluation_prompt = f"""
+# Per-conversation judge prompt; only {chat_history} is filled in
+JUDGE_PROMPT_TEMPLATE = """
                                 請評估以下 JTCG 客服對話：
 
                                 完整對話記錄：
@@ -75,149 +129,714 @@ class LLMJudgeEvaluator:
                                 評估時請考慮對話的完整脈絡，包括用戶的問題和客服的回應是否符合上下文，以及整個對話的質量。
                                 """
 
-            result = Runner.run_sync(self.judge_agent, evaluation_prompt)
-            response_text = result.final_output
+class JudgeVerdict(TypedDict):
+    """Structured output the judge is constrained to"""
+    within_scope: bool
+    correct_content: bool
+    reasoning: str
+
+# Local triage (--triage): user turns that only mention off-topic subjects are marked
+# out of scope without a judge call; anything touching JTCG's services goes to the judge
+TRIAGE_IN_SCOPE_RE = re.compile(r"JTCG|螢幕臂|支架|VESA|訂單|order|u_\d+|退換貨|退貨|換貨|保固|發票|運費|付款|客服",
+                                re.IGNORECASE)
+TRIAGE_OUT_OF_SCOPE_RE = re.compile(r"天氣|股票|股價|食譜|weather|stock price|recipe|python", re.IGNORECASE)
+
+# Cap on judge output; the verdict is three fields and a short reason
+JUDGE_MAX_TOKENS = 500
+
+# Chat Completions response_format for Batch API requests, the same schema the judge Agent enforces
+JUDGE_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "judge_verdict",
+        "strict": True,
+        "schema": AgentOutputSchema(JudgeVerdict).json_schema()
+    }
+}
+
+# SQLite sidecar holding judge verdicts from earlier runs (disable with --no-judge-cache)
+JUDGE_CACHE_PATH = ".judge_cache.sqlite"
+# Verdicts older than this are re-judged (seconds)
+JUDGE_CACHE_TTL = 14 * 24 * 3600
+
+# Models without json_schema structured outputs (gpt-4, gpt-4-turbo, gpt-3.5-turbo and their
+# dated snapshots); their verdicts come back as free text with a JSON object in it
+NO_STRUCTURED_OUTPUT_MODEL_RE = re.compile(r"^gpt-(?:3\.5|4)(?![o.])")
+
+# Characters that matter when scanning a judge reply for a JSON object
+JSON_SCAN_RE = re.compile(r'[{}"\\]')
+
+def _supports_structured_outputs(model: str) -> bool:
+    return not NO_STRUCTURED_OUTPUT_MODEL_RE.match(model)
+
+def _first_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """Decode the first balanced {...} in text that is a valid JSON object
+
+    Braces inside JSON strings are ignored, and the regex skips over plain text
+    in C, so only the structural characters are visited in Python.
+    """
+    depth = 0
+    start = -1
+    in_string = False
+    escaped = -1
+    for match in JSON_SCAN_RE.finditer(text):
+        pos = match.start()
+        if pos == escaped:
+            continue
+        char = text[pos]
+        if in_string:
+            if char == '\\':
+                escaped = pos + 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = depth > 0
+        elif char == '{':
+            if depth == 0:
+                start = pos
+            depth += 1
+        elif char == '}' and depth:
+            depth -= 1
+            if depth == 0:
+                try:
+                    candidate = orjson.loads(text[start:pos + 1])
+                except orjson.JSONDecodeError:
+                    continue
+                if isinstance(candidate, dict):
+                    return candidate
+    return None
+
+def _judge_error(reason: str) -> Dict[str, Any]:
+    """Row update for a conversation the judge failed on; left out of the accuracy rates"""
+    return {
+        "within_scope": None,
+        "correct_content": None,
+        "reasoning": reason,
+        "judge_error": True
+    }
+
+@lru_cache(maxsize=4)
+def _judge_agent(model: str) -> Agent:
+    """One judge Agent per model, shared by every LLMJudgeEvaluator"""
+    return Agent(
+        name="JTCG_Response_Judge",
+        instructions=JUDGE_INSTRUCTIONS,
+        model=model,
+        output_type=JudgeVerdict if _supports_structured_outputs(model) else None,
+        model_settings=ModelSettings(max_tokens=JUDGE_MAX_TOKENS)
+    )
+
+class JudgeCache:
+    """Judge verdicts persisted across runs, so re-running an evaluation only pays for new transcripts"""
+
+    def __init__(self, path: str = JUDGE_CACHE_PATH, ttl: float = JUDGE_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS judge_verdicts "
+                           "(key TEXT PRIMARY KEY, evaluation TEXT NOT NULL, created_at REAL NOT NULL)")
+        # Drop expired verdicts up front so the file doesn't grow without bound
+        self._conn.execute("DELETE FROM judge_verdicts WHERE created_at < ?", (time.time() - ttl,))
+        self._conn.commit()
+
+    @staticmethod
+    def key(*parts: str) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT evaluation FROM judge_verdicts WHERE key = ? AND created_at >= ?",
+                                     (key, time.time() - self.ttl)).fetchone()
+        return orjson.loads(row[0]) if row else None
+
+    def set(self, key: str, evaluation: Dict[str, Any]):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO judge_verdicts (key, evaluation, created_at) VALUES (?, ?, ?)",
+                               (key, orjson.dumps(evaluation).decode("utf-8"), time.time()))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class RequestRateLimiter:
+    """Async token bucket: at most max_rate requests per time_period seconds, bursting up to max_rate"""
+
+    def __init__(self, max_rate: float, time_period: float = 60.0):
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._tokens = float(max_rate)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Waiters queue on the lock, so tokens are handed out in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.max_rate,
+                                   self._tokens + (now - self._updated) * self.max_rate / self.time_period)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) * self.time_period / self.max_rate)
 
-            # Try to extract JSON from response
-            try:
-                # Look for JSON in the response
-                start_idx = response_text.find('{')
-                end_idx = response_text.rfind('}') + 1
-                if start_idx != -1 and end_idx > start_idx:
-                    json_str = response_text[start_idx:end_idx]
-                    evaluation = json.loads(json_str)
-                else:
-                    # Fallback: try to parse the whole response
-                    evaluation = json.loads(response_text)
-
-                return {
-                    "within_scope": evaluation.get("within_scope", True),
-                    "correct_content": evaluation.get("correct_content", True),
-                    "reasoning": evaluation.get("reasoning", "LLM evaluation completed")
-                }
-            except json.JSONDecodeError:
-                # Fallback if JSON parsing fails
-                return {
-                    "within_scope": True,  # Default to True for safety
-                    "correct_content": True,
-                    "reasoning": f"JSON parsing failed. Raw response: {response_text[:200]}..."
-                }
+class LLMJudgeEvaluator:
+    """LLM Judge to evaluate agent responses"""
+
+    def __init__(self, openai_api_key: str, cache: Optional[JudgeCache] = None,
+                 run_config: Optional[RunConfig] = None, rate_limiter: Optional[RequestRateLimiter] = None):
+        # The key goes to the judge's own clients rather than the process environment
+        self.api_key = openai_api_key
+        set_tracing_export_api_key(openai_api_key)
+        # One provider, so every judge call reuses the same client and connection pool;
+        # callers can pass the agent's run_config to share its client as well
+        self.run_config = run_config or RunConfig(model_provider=OpenAIProvider(api_key=openai_api_key))
+        self.cache = cache
+        # Optional requests-per-minute cap, also applied to rate-limit retries
+        self.rate_limiter = rate_limiter
+        # Input tokens sent to the judge, and how many OpenAI served from its prompt cache
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+
+        # Shared judge agent for this model
+        self.judge_agent = _judge_agent(os.getenv("OPENAI_MODEL", "gpt-4"))
+
+    def _get_judge_instructions(self) -> str:
+        return JUDGE_INSTRUCTIONS
+
+    @retry(
+        retry=retry_if_exception_type(RateLimitError),
+        wait=wait_exponential(multiplier=1, max=30),
+        stop=stop_after_attempt(5),
+        reraise=True
+    )
+    async def _run_judge(self, evaluation_prompt: str) -> Any:
+        """Run the judge agent, backing off exponentially on rate limits"""
+        if self.rate_limiter is not None:
+            await self.rate_limiter.acquire()
+        result = await Runner.run(self.judge_agent, evaluation_prompt, run_config=self.run_config)
+        usage = result.context_wrapper.usage
+        self.prompt_tokens += usage.input_tokens
+        self.cached_prompt_tokens += usage.input_tokens_details.cached_tokens
+        # A JudgeVerdict, or the reply text for models without structured outputs
+        return result.final_output
+
+    def log_prompt_cache_usage(self):
+        """Log how much of the judge's input was billed at the cached-prompt rate"""
+        if self.prompt_tokens:
+            logger.info(f"Judge input tokens: {self.prompt_tokens}, "
+                        f"{self.cached_prompt_tokens / self.prompt_tokens * 100:.1f}% served from the prompt cache")
+
+    @staticmethod
+    def quick_triage(chat_history: str) -> Optional[Dict[str, Any]]:
+        """Verdict for clearly out-of-scope conversations, or None if the judge is needed"""
+        # chat_history lines are joined with a literal "\\n"; only the user's turns decide scope
+        user_text = " ".join(line[len("User: "):] for line in chat_history.split("\\n") if line.startswith("User: "))
+        if TRIAGE_IN_SCOPE_RE.search(user_text):
+            return None
+        match = TRIAGE_OUT_OF_SCOPE_RE.search(user_text)
+        if not match:
+            return None
+        return {
+            "within_scope": False,
+            "correct_content": False,
+            "reasoning": f"Triaged locally: out-of-scope question ({match.group(0)})"
+        }
+
+    def _build_evaluation_prompt(self, chat_history: str) -> str:
+        return JUDGE_PROMPT_TEMPLATE.format(chat_history=chat_history)
+
+    def _cache_key(self, evaluation_prompt: str) -> str:
+        # Model and instructions are part of the key, so editing the judge invalidates old verdicts
+        return JudgeCache.key(self.judge_agent.model, self.judge_agent.instructions, evaluation_prompt)
+
+    def _parse_evaluation(self, response_text: str, cache_key: Optional[str] = None) -> Dict[str, Any]:
+        """Decode a verdict from a judge reply, caching it if valid"""
+        try:
+            # Free-text replies may wrap the JSON object in prose, a code fence or more braces
+            evaluation = _first_json_object(response_text)
+            if evaluation is None:
+                evaluation = orjson.loads(response_text)
+            verdict = {
+                "within_scope": evaluation["within_scope"],
+                "correct_content": evaluation["correct_content"],
+                "reasoning": evaluation["reasoning"]
+            }
+            if not isinstance(verdict["within_scope"], bool) or not isinstance(verdict["correct_content"], bool):
+                raise TypeError("verdict fields must be booleans")
+        except (orjson.JSONDecodeError, TypeError, KeyError):
+            # Refusals and truncated replies don't match the schema
+            return _judge_error(f"JSON parsing failed. Raw response: {response_text[:200]}...")
+
+        if self.cache is not None and cache_key is not None:
+            self.cache.set(cache_key, verdict)
+        return verdict
+
+    def evaluate_response(self, chat_history: str) -> Dict[str, Any]:
+        """Evaluate a conversation based on complete chat history"""
+        # Blocking wrapper, reusing this thread's event loop like Runner.run_sync
+        return asyncio.get_event_loop().run_until_complete(self.evaluate_response_async(chat_history))
+
+    async def evaluate_response_async(self, chat_history: str) -> Dict[str, Any]:
+        """Async version of evaluate_response, so many judge calls can share one event loop"""
+        try:
+            evaluation_prompt = self._build_evaluation_prompt(chat_history)
+            cache_key = self._cache_key(evaluation_prompt) if self.cache is not None else None
+            if cache_key is not None:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    return cached
+
+            output = await self._run_judge(evaluation_prompt)
+            if isinstance(output, str):
+                return self._parse_evaluation(output, cache_key)
+
+            # The SDK validated the structured output against JudgeVerdict
+            verdict = dict(output)
+            if cache_key is not None:
+                self.cache.set(cache_key, verdict)
+            return verdict
 
         except Exception as e:
             logger.error(f"Error in LLM evaluation: {e}")
-            return {
-                "within_scope": True,  # Default to True for safety
-                "correct_content": True,
-                "reasoning": f"Evaluation error: {str(e)}"
+            return _judge_error(f"Evaluation error: {str(e)}")
+
+    def evaluate_batch(self, chat_histories: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+        """Evaluate many conversations in one OpenAI Batch job, keyed by custom_id
+
+        Batch jobs are billed at half price and skip per-request overhead, at the
+        cost of latency (up to the 24h completion window), so this is meant for
+        offline full runs.
+        """
+        evaluations = {}
+        cache_keys = {}
+        lines = []
+        for custom_id, chat_history in chat_histories.items():
+            evaluation_prompt = self._build_evaluation_prompt(chat_history)
+            if self.cache is not None:
+                cache_keys[custom_id] = self._cache_key(evaluation_prompt)
+                cached = self.cache.get(cache_keys[custom_id])
+                if cached is not None:
+                    evaluations[custom_id] = cached
+                    continue
+            body = {
+                "model": self.judge_agent.model,
+                "messages": [
+                    {"role": "system", "content": self.judge_agent.instructions},
+                    {"role": "user", "content": evaluation_prompt}
+                ],
+                "max_tokens": JUDGE_MAX_TOKENS
             }
+            if self.judge_agent.output_type is not None:
+                body["response_format"] = JUDGE_RESPONSE_FORMAT
+            lines.append(orjson.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body
+            }))
+
+        if not lines:
+            logger.info("All judge verdicts served from cache; no batch submitted")
+            return evaluations
+
+        client = OpenAI(api_key=self.api_key)
+        batch_input = client.files.create(
+            file=("judge_batch.jsonl", b"\n".join(lines)),
+            purpose="batch"
+        )
+        batch = client.batches.create(
+            input_file_id=batch_input.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        logger.info(f"Submitted judge batch {batch.id} with {len(lines)} requests "
+                    f"({len(evaluations)} served from cache)")
+
+        while batch.status not in BATCH_TERMINAL_STATUSES:
+            time.sleep(BATCH_POLL_INTERVAL)
+            batch = client.batches.retrieve(batch.id)
+            counts = batch.request_counts
+            if counts:
+                logger.info(f"Judge batch {batch.status}: {counts.completed}/{counts.total} done")
+
+        if batch.output_file_id:
+            for line in client.files.content(batch.output_file_id).content.splitlines():
+                if not line.strip():
+                    continue
+                item = orjson.loads(line)
+                response = item.get("response") or {}
+                if response.get("status_code") == 200:
+                    usage = response["body"].get("usage") or {}
+                    self.prompt_tokens += usage.get("prompt_tokens", 0)
+                    self.cached_prompt_tokens += (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+                    response_text = response["body"]["choices"][0]["message"]["content"] or ""
+                    custom_id = item["custom_id"]
+                    evaluations[custom_id] = self._parse_evaluation(response_text, cache_keys.get(custom_id))
+
+        # Anything the batch didn't answer (failed, expired, per-request errors)
+        for custom_id in chat_histories:
+            if custom_id not in evaluations:
+                evaluations[custom_id] = _judge_error(
+                    f"Evaluation error: no result in batch {batch.id} (status: {batch.status})")
+
+        return evaluations
+
+class EvaluationStats:
+    """Running totals behind the evaluation summary, updated one row at a time"""
+
+    def __init__(self):
+        self.total_conversations = 0
+        self.successful_responses = 0
+        self.within_scope_count = 0
+        self.correct_content_count = 0
+        self.response_time_sum = 0.0
+        self.response_time_count = 0
+        self.responses_with_links = 0
+        self.judge_errors = 0
+
+    def add(self, result: ConversationResult):
+        self.total_conversations += 1
+        if result.success:
+            self.successful_responses += 1
+            self.response_time_sum += result.response_time
+            self.response_time_count += 1
+
+        # LLM Judge metrics; failed judgments have no verdict to count
+        if result.judge_error:
+            self.judge_errors += 1
+        else:
+            if result.within_scope:
+                self.within_scope_count += 1
+            if result.correct_content:
+                self.correct_content_count += 1
+
+        if result.has_source_links:
+            self.responses_with_links += 1
+
+    def summary(self) -> Dict[str, Any]:
+        total = self.total_conversations
+        judged = total - self.judge_errors
+
+        def rate(count: int, out_of: int = total) -> float:
+            return (count / out_of * 100) if out_of > 0 else 0
+
+        return {
+            "test_date": datetime.now().isoformat(),
+            "total_conversations": total,
+            "successful_responses": self.successful_responses,
+            "success_rate": rate(self.successful_responses),
+            "within_scope_count": self.within_scope_count,
+            "within_scope_rate": rate(self.within_scope_count, judged),
+            "correct_content_count": self.correct_content_count,
+            "correct_content_rate": rate(self.correct_content_count, judged),
+            "judge_errors": self.judge_errors,
+            "avg_response_time": (self.response_time_sum / self.response_time_count) if self.response_time_count else 0,
+            "responses_with_source_links": self.responses_with_links,
+            "source_link_rate": rate(self.responses_with_links),
+        }
+
+class EvaluationCSVWriter:
+    """Append evaluation rows to a CSV file as they complete, one line per row
+
+    With resume=True an existing file is appended to instead of replaced; its rows
+    are counted into the summary and their ids collected in completed_ids, and new
+    rows follow the file's own header so older layouts stay readable.
+    """
+
+    def __init__(self, filename: str, resume: bool = False):
+        self.filename = filename
+        # Summary totals for every row written, so the summary needs no second pass
+        self.stats = EvaluationStats()
+        self.completed_ids = set()
+        self.fieldnames = EVALUATION_FIELDNAMES
+
+        if resume and os.path.exists(filename):
+            self._drop_partial_row()
+        existing = resume and os.path.exists(filename) and os.path.getsize(filename) > 0
+        if existing:
+            self._load_existing()
+        self._csvfile = open(filename, 'a' if existing else 'w', newline='', encoding='utf-8')
+        # Plain csv.writer over positional rows; cells are quoted only when they need it
+        self._writer = csv.writer(self._csvfile, quoting=csv.QUOTE_MINIMAL)
+        if not existing:
+            self._writer.writerow(self.fieldnames)
+
+    def _drop_partial_row(self):
+        """Cut off a last line left unfinished by a crash mid-write
+
+        Every row is written on one line, so anything after the last newline is
+        a partial row; appending to it would also corrupt the next row.
+        """
+        with open(self.filename, 'rb+') as csvfile:
+            end = csvfile.seek(0, os.SEEK_END)
+            pos = end
+            # Walk back block by block to the last newline
+            while pos > 0:
+                step = min(pos, 65536)
+                pos -= step
+                csvfile.seek(pos)
+                newline = csvfile.read(step).rfind(b"\n")
+                if newline != -1:
+                    pos += newline + 1
+                    break
+            if pos < end:
+                csvfile.truncate(pos)
+                logger.warning(f"Dropped an unfinished last row from {self.filename}")
+
+    def _load_existing(self):
+        with open(self.filename, newline='', encoding='utf-8') as csvfile:
+            reader = csv.DictReader(csvfile)
+            header = reader.fieldnames or []
+            missing = [field for field in RESUME_FIELDNAMES if field not in header]
+            unknown = [field for field in header if field not in EVALUATION_FIELDNAMES]
+            if missing or unknown:
+                raise ValueError(f"Cannot resume {self.filename}: its header does not match the evaluation columns "
+                                 f"(missing: {', '.join(missing) or 'none'}; unknown: {', '.join(unknown) or 'none'})")
+
+            skipped = 0
+            for row in reader:
+                # Rows with too few or too many cells, or unreadable numbers, are not counted
+                # as done, so their conversations run again
+                if None in row or None in row.values():
+                    skipped += 1
+                    continue
+                try:
+                    result = ConversationResult(
+                        conversation_id=int(row["conversation_id"]),
+                        success=row["success"] == "True",
+                        response_time=float(row["response_time"] or 0),
+                        within_scope=row["within_scope"] == "True",
+                        correct_content=row["correct_content"] == "True",
+                        # Files written before the judge_error column have no such key; only a
+                        # failed judgment leaves within_scope empty
+                        judge_error=(row["judge_error"] == "True" if "judge_error" in row
+                                     else row["within_scope"] == ""),
+                        has_source_links=row["has_source_links"] == "True"
+                    )
+                except ValueError:
+                    skipped += 1
+                    continue
+                self.completed_ids.add(result.conversation_id)
+                self.stats.add(result)
+            self.fieldnames = header
+        if skipped:
+            logger.warning(f"Skipped {skipped} malformed rows in {self.filename}")
+        logger.info(f"Resuming {self.filename}: {len(self.completed_ids)} conversations already evaluated")
+
+    def writerow(self, result: ConversationResult):
+        # Only clean the fields that are written; chat_history etc. are skipped
+        row = []
+        for field in self.fieldnames:
+            value = getattr(result, field)
+            # Replace newlines with literal \n to avoid multi-line cells
+            row.append(value.translate(CSV_ESCAPES) if isinstance(value, str) else value)
+        self._writer.writerow(row)
+        self.stats.add(result)
+        # Flush so a crashed run still leaves every finished row on disk
+        self._csvfile.flush()
+
+    def close(self):
+        self._csvfile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
 class FullEvaluationRunner:
     """Run full evaluation with LLM judge"""
 
-    def __init__(self, openai_api_key: str):
+    def __init__(self, openai_api_key: str, judge_cache: Optional[JudgeCache] = None, judge_rpm: int = 0):
         self.api_key = openai_api_key
         self.conversation_tester = ConversationTester(openai_api_key)
-        self.llm_judge = LLMJudgeEvaluator(openai_api_key)
-
-    def run_full_evaluation(self, max_conversations: int = None, start_from: int = 0) -> List[Dict[str, Any]]:
-        """Run evaluation on all conversations with LLM judge"""
+        self.judge_cache = judge_cache
+        self.judge_rpm = judge_rpm
+        self._llm_judge = None
+
+    @property
+    def llm_judge(self) -> LLMJudgeEvaluator:
+        """Judge evaluator, built on first use so runs with nothing to judge skip it"""
+        if self._llm_judge is None:
+            # Judge through the agent's provider so both share one AsyncOpenAI client
+            rate_limiter = RequestRateLimiter(self.judge_rpm) if self.judge_rpm > 0 else None
+            self._llm_judge = LLMJudgeEvaluator(self.api_key, cache=self.judge_cache,
+                                                run_config=self.conversation_tester.agent.run_config,
+                                                rate_limiter=rate_limiter)
+        return self._llm_judge
+
+    def run_full_evaluation(self, max_conversations: int = None, start_from: int = 0,
+                            workers: int = DEFAULT_JUDGE_WORKERS, async_batch: bool = False,
+                            writer: Optional[EvaluationCSVWriter] = None,
+                            agent_workers: int = DEFAULT_AGENT_WORKERS, triage: bool = False) -> List[ConversationResult]:
+        """Run evaluation on all conversations with LLM judge
+
+        Each conversation is judged as soon as the agent has answered it, so the
+        agent and judge phases overlap; with async_batch all agent results are
+        collected first and judged in one Batch API job.
+
+        With a writer, each row is written out as soon as it is judged and its
+        TRANSCRIPT_FIELDS are then cleared in the returned list. With triage, clearly
+        out-of-scope conversations are scored locally instead of by the judge.
+        """
+        test_options = {
+            "max_conversations": max_conversations,
+            "start_from": start_from,
+            "workers": agent_workers,
+            "skip_ids": writer.completed_ids if writer is not None else frozenset()
+        }
 
         # Run agent tests
         logger.info("Starting JTCG Agent evaluation...")
-        results = self.conversation_tester.run_all_tests(max_conversations=max_conversations, start_from=start_from)
-
-        # Run LLM judge evaluation
-        logger.info("Starting LLM judge evaluation...")
-        for i, result in enumerate(results, 1):
-            if i % 10 == 0:
-                logger.info(f"LLM Judge progress: {i}/{len(results)}")
+        if async_batch:
+            results = self._run_batch_evaluation(test_options, writer, triage)
+        else:
+            logger.info(f"Judging conversations as they finish, with up to {workers} concurrent judge request(s)...")
+            results = asyncio.get_event_loop().run_until_complete(
+                self._run_pipelined_evaluation(test_options, workers, writer, triage))
+
+        if self._llm_judge is not None:
+            self._llm_judge.log_prompt_cache_usage()
+        return results
 
-            chat_history = result.get("chat_history", "")
+    @staticmethod
+    def _precheck(result: ConversationResult) -> Optional[Dict[str, Any]]:
+        """Verdict for results the judge has nothing to assess, else None"""
+        if not result.success or not result.chat_history.strip():
+            # Mark failed responses
+            return {
+                "within_scope": False,
+                "correct_content": False,
+                "reasoning": "Agent response failed"
+            }
+        if result.agent_response.startswith(CHAT_ERROR_PREFIX):
+            # chat() caught an error and returned its apology text; nothing for the judge to assess
+            return {
+                "within_scope": False,
+                "correct_content": False,
+                "reasoning": "Agent returned its error reply"
+            }
+        return None
+
+    @staticmethod
+    def _finish(result: ConversationResult, evaluation: Dict[str, Any],
+                writer: Optional[EvaluationCSVWriter]) -> ConversationResult:
+        """Merge a verdict into its result and write it out; returns the row to keep"""
+        result.update(evaluation)
+        if writer is not None:
+            writer.writerow(result)
+            # Drop the transcript and reasoning once they are on disk
+            for field in TRANSCRIPT_FIELDS:
+                setattr(result, field, "")
+        return result
+
+    @staticmethod
+    def _log_triage(triaged: int, judged: int):
+        logger.info(f"Triaged {triaged}/{triaged + judged} conversations locally "
+                    f"({triaged / max(triaged + judged, 1) * 100:.1f}%), {judged} sent to the judge")
+
+    async def _run_pipelined_evaluation(self, test_options: Dict[str, Any], concurrency: int,
+                                        writer: Optional[EvaluationCSVWriter], triage: bool) -> List[ConversationResult]:
+        """Judge each agent result as soon as it arrives, at most `concurrency` judge requests in flight"""
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+        judged = 0
+        triaged = 0
+        # Verdict per conversation_id, so duplicate conversations reuse their original's
+        verdicts: Dict[int, asyncio.Future] = {}
+
+        def verdict_for(conversation_id: int) -> asyncio.Future:
+            return verdicts.setdefault(conversation_id, asyncio.get_running_loop().create_future())
+
+        async def judge(result: ConversationResult) -> ConversationResult:
+            nonlocal judged, triaged
+            if result.duplicate_of is not None:
+                return self._finish(result, await verdict_for(result.duplicate_of), writer)
+
+            verdict = verdict_for(result.conversation_id)
+            try:
+                evaluation = self._precheck(result)
+                if evaluation is None and triage:
+                    evaluation = LLMJudgeEvaluator.quick_triage(result.chat_history)
+                    triaged += evaluation is not None
+                if evaluation is None:
+                    async with semaphore:
+                        evaluation = await self.llm_judge.evaluate_response_async(result.chat_history)
+                    judged += 1
+                    if judged % 10 == 0:
+                        logger.info(f"LLM Judge progress: {judged} conversations judged")
+            except Exception as e:
+                verdict.set_exception(e)
+                raise
+            verdict.set_result(evaluation)
+            return self._finish(result, evaluation, writer)
+
+        results = await self.conversation_tester.run_all_tests_async(on_result=judge, **test_options)
+        if triage:
+            self._log_triage(triaged, judged)
+        return results
 
-            if result.get("success", False) and chat_history:
-                evaluation = self.llm_judge.evaluate_response(chat_history)
-                result.update(evaluation)
+    def _run_batch_evaluation(self, test_options: Dict[str, Any], writer: Optional[EvaluationCSVWriter],
+                              triage: bool) -> List[ConversationResult]:
+        """Run every conversation first, then judge them all in one Batch API job"""
+        results = self.conversation_tester.run_all_tests(**test_options)
+
+        jobs = []
+        duplicates = []
+        verdicts = {}  # conversation_id -> evaluation, reused by that conversation's duplicates
+        triaged = 0
+        for i, result in enumerate(results):
+            if result.duplicate_of is not None:
+                duplicates.append(i)
+                continue
+            evaluation = self._precheck(result)
+            if evaluation is None and triage:
+                evaluation = LLMJudgeEvaluator.quick_triage(result.chat_history)
+                triaged += evaluation is not None
+            if evaluation is None:
+                jobs.append(i)
             else:
-                # Mark failed responses
-                result.update({
-                    "within_scope": False,
-                    "correct_content": False,
-                    "reasoning": "Agent response failed"
-                })
-
-            # Small delay to avoid rate limiting
-            time.sleep(0.1)
-
+                verdicts[result.conversation_id] = evaluation
+                results[i] = self._finish(result, evaluation, writer)
+
+        if triage:
+            self._log_triage(triaged, len(jobs))
+
+        if len(jobs) > 1:
+            logger.info(f"Submitting {len(jobs)} conversations to the OpenAI Batch API...")
+            evaluations = self.llm_judge.evaluate_batch({str(i): results[i].chat_history for i in jobs})
+        else:
+            # A single request isn't worth a batch job
+            evaluations = {str(i): self.llm_judge.evaluate_response(results[i].chat_history) for i in jobs}
+        for i in jobs:
+            verdicts[results[i].conversation_id] = evaluations[str(i)]
+            results[i] = self._finish(results[i], evaluations[str(i)], writer)
+        # Duplicates take their original's verdict instead of a second judge request
+        for i in duplicates:
+            results[i] = self._finish(results[i], verdicts[results[i].duplicate_of], writer)
         return results
 
-    def save_evaluation_results(self, results: List[Dict[str, Any]], filename: str):
+    def save_evaluation_results(self, results: List[ConversationResult], filename: str):
         """Save evaluation results to CSV with proper one-line formatting"""
-
-        fieldnames = [
-            "conversation_id",
-            "user_message",
-            "agent_response",
-            "response_time",
-            "success",
-            "error",
-            "within_scope",  # LLM Judge evaluation
-            "correct_content",  # LLM Judge evaluation
-            "reasoning",  # LLM Judge reasoning
-            "brand_voice",
-            "has_source_links",
-            "actionable_next_steps",
-            "overall_rating",
-            "manual_review_notes"
-        ]
-
-        with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames, quoting=csv.QUOTE_ALL)
-            writer.writeheader()
-
+        with EvaluationCSVWriter(filename) as writer:
             for result in results:
-                # Clean up any values that might cause CSV issues
-                clean_result = {}
-                for key, value in result.items():
-                    if isinstance(value, str):
-                        # Replace newlines with literal \n to avoid multi-line cells
-                        clean_result[key] = value.replace('\n', '\\n').replace('\r', '\\r').replace('\t', ' ')
-                    else:
-                        clean_result[key] = value
-
-                # Ensure all required fieldnames have values
-                row = {field: clean_result.get(field, "") for field in fieldnames}
-                writer.writerow(row)
+                writer.writerow(result)
 
         logger.info(f"Evaluation results saved to {filename}")
 
-    def generate_evaluation_summary(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def generate_evaluation_summary(self, results: List[ConversationResult]) -> Dict[str, Any]:
         """Generate comprehensive evaluation summary"""
-        total_conversations = len(results)
-        successful_responses = sum(1 for r in results if r.get("success", False))
-
-        # LLM Judge metrics
-        within_scope_count = sum(1 for r in results if r.get("within_scope", False))
-        correct_content_count = sum(1 for r in results if r.get("correct_content", False))
-
-        # Technical metrics
-        response_times = [r["response_time"] for r in results if r.get("success", False) and "response_time" in r]
-        avg_response_time = sum(response_times) / len(response_times) if response_times else 0
-
-        responses_with_links = sum(1 for r in results if r.get("has_source_links", False))
-
-        return {
-            "test_date": datetime.now().isoformat(),
-            "total_conversations": total_conversations,
-            "successful_responses": successful_responses,
-            "success_rate": (successful_responses / total_conversations * 100) if total_conversations > 0 else 0,
-            "within_scope_count": within_scope_count,
-            "within_scope_rate": (within_scope_count / total_conversations * 100) if total_conversations > 0 else 0,
-            "correct_content_count": correct_content_count,
-            "correct_content_rate": (correct_content_count / total_conversations * 100) if total_conversations > 0 else 0,
-            "avg_response_time": avg_response_time,
-            "responses_with_source_links": responses_with_links,
-            "source_link_rate": (responses_with_links / total_conversations * 100) if total_conversations > 0 else 0,
-        }
+        stats = EvaluationStats()
+        for result in results:
+            stats.add(result)
+        return stats.summary()
 
     def print_evaluation_summary(self, summary: Dict[str, Any]):
         """Print formatted evaluation summary"""
@@ -237,6 +856,8 @@ class FullEvaluationRunner:
         print(f"  Scope Accuracy Rate: {summary['within_scope_rate']:.1f}%")
         print(f"  Correct Content: {summary['correct_content_count']}")
         print(f"  Content Accuracy Rate: {summary['correct_content_rate']:.1f}%")
+        if summary['judge_errors']:
+            print(f"  Judge Errors: {summary['judge_errors']} (excluded from the accuracy rates)")
         print("="*70)
         print("\nEVALUATION COMPLETE!")
         print("Review the CSV file for detailed LLM judge evaluations.")
@@ -250,6 +871,23 @@ def main():
                         help='Maximum number of conversations to test (default: all 323 conversations)')
     parser.add_argument('--start-from', '-s', type=int, default=0,
                         help='Start evaluation from conversation number (0-based index, default: 0)')
+    parser.add_argument('--workers', '-w', type=int,
+                        default=int(os.getenv("JUDGE_WORKERS", DEFAULT_JUDGE_WORKERS)),
+                        help=f'Concurrent LLM judge requests; 1 runs sequentially (default: {DEFAULT_JUDGE_WORKERS})')
+    parser.add_argument('--judge-rpm', type=int, default=int(os.getenv("JUDGE_RPM", 0)),
+                        help='Cap LLM judge requests per minute; 0 leaves them unthrottled (default: 0)')
+    parser.add_argument('--agent-workers', type=int,
+                        default=int(os.getenv("AGENT_WORKERS", DEFAULT_AGENT_WORKERS)),
+                        help=f'Conversations run against the agent at once; 1 runs sequentially, which is also the only '
+                             f'setting whose response times are comparable with sequential runs (default: {DEFAULT_AGENT_WORKERS})')
+    parser.add_argument('--judge-cache', action=argparse.BooleanOptionalAction, default=True,
+                        help=f'Reuse LLM judge verdicts for unchanged conversations from {JUDGE_CACHE_PATH} (default: on)')
+    parser.add_argument('--resume', metavar='CSV',
+                        help='Append to an earlier, interrupted evaluation CSV, skipping conversations it already has')
+    parser.add_argument('--triage', action='store_true',
+                        help='Mark clearly off-topic conversations out of scope locally instead of calling the judge')
+    parser.add_argument('--async-batch', action='store_true',
+                        help='Submit all LLM judge requests as one OpenAI Batch job (cheaper, may take hours)')
 
     args = parser.parse_args()
 
@@ -271,25 +909,42 @@ def main():
     if args.start_from > 0:
         print(f"Starting from conversation #{args.start_from}")
 
-    # Initialize evaluator
-    print("Initializing evaluators...")
-    evaluator = FullEvaluationRunner(api_key)
-
-    # Run evaluation with specified parameters
-    print("Starting evaluation...")
-    results = evaluator.run_full_evaluation(max_conversations=args.max_conversations, start_from=args.start_from)
-
-    # Save results
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    if args.max_conversations:
+    if args.resume:
+        csv_filename = args.resume
+    elif args.max_conversations:
         csv_filename = f"jtcg_evaluation_{args.max_conversations}conversations_{timestamp}.csv"
     else:
         csv_filename = f"jtcg_evaluation_full_{timestamp}.csv"
 
-    evaluator.save_evaluation_results(results, csv_filename)
+    try:
+        writer = EvaluationCSVWriter(csv_filename, resume=bool(args.resume))
+    except ValueError as e:
+        # A --resume file with another column layout
+        print(e)
+        return
 
-    # Generate and print summary
-    summary = evaluator.generate_evaluation_summary(results)
+    # Initialize evaluator
+    print("Initializing evaluators...")
+    judge_cache = JudgeCache() if args.judge_cache else None
+    evaluator = FullEvaluationRunner(api_key, judge_cache=judge_cache, judge_rpm=args.judge_rpm)
+
+    # Run evaluation with specified parameters, streaming rows to the CSV as they are judged
+    print("Starting evaluation...")
+    with writer:
+        results = evaluator.run_full_evaluation(max_conversations=args.max_conversations, start_from=args.start_from,
+                                                workers=args.workers, async_batch=args.async_batch, writer=writer,
+                                                agent_workers=args.agent_workers, triage=args.triage)
+    logger.info(f"Evaluation results saved to {csv_filename}")
+    if judge_cache is not None:
+        judge_cache.close()
+    # Searches the agent ran with a query embedding it had already computed
+    if embedding_cache.hits or embedding_cache.misses:
+        logger.info(f"Query embedding cache: {embedding_cache.hits} hits, {embedding_cache.misses} misses "
+                    f"({embedding_cache.hit_ratio * 100:.1f}% hit ratio)")
+
+    # Print the summary accumulated while rows were written
+    summary = writer.stats.summary()
     evaluator.print_evaluation_summary(summary)
 
     print(f"\nEVALUATION COMPLETE!")
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+import numpy as np
+
+# Default cosine-similarity threshold for a cache hit (override with JTCG_CACHE_TAU)
+DEFAULT_CACHE_TAU = 0.92
+
+@dataclass(slots=True)
+class CacheHit:
+    message: str
+    response: str
+    similarity: float
+
+class SemanticCache:
+    """In-process cache of (message embedding, response) pairs matched by cosine similarity"""
+
+    def __init__(self, tau: Optional[float] = None, max_entries: int = 1024):
+        self.tau = tau if tau is not None else float(os.getenv("JTCG_CACHE_TAU", DEFAULT_CACHE_TAU))
+        self.max_entries = max_entries
+
+        # One L2-normalized embedding per row, so cosine similarity is a single matrix-vector product
+        self._embeddings: Optional[np.ndarray] = None
+        self._messages: List[str] = []
+        self._responses: List[str] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding, tau: Optional[float] = None) -> Optional[CacheHit]:
+        """Return the most similar cached response if its similarity reaches tau"""
+        query = self._normalize(embedding)
+        threshold = self.tau if tau is None else tau
+
+        with self._lock:
+            if self._embeddings is None:
+                return None
+            scores = self._embeddings @ query
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < threshold:
+                return None
+            return CacheHit(self._messages[best], self._responses[best], similarity)
+
+    def insert(self, embedding, message: str, response: str):
+        """Cache a response, evicting the oldest entry once max_entries is reached"""
+        vector = self._normalize(embedding)[np.newaxis, :]
+
+        with self._lock:
+            if self._embeddings is None:
+                self._embeddings = vector
+            else:
+                if len(self._responses) >= self.max_entries:
+                    self._embeddings = self._embeddings[1:]
+                    del self._messages[0]
+                    del self._responses[0]
+                self._embeddings = np.vstack([self._embeddings, vector])
+            self._messages.append(message)
+            self._responses.append(response)
+
+    def clear(self):
+        """Drop all cached responses"""
+        with self._lock:
+            self._embeddings = None
+            self._messages.clear()
+            self._responses.clear()
+
+class EmbeddingCache:
+    """LRU cache of text embeddings keyed by the SHA-256 of the normalized text"""
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_ratio(self) -> float:
+        """Fraction of lookups served from the cache"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @staticmethod
+    def key(text: str) -> str:
+        """Cache key for a text; the embedding model is uncased, so case and outer whitespace are ignored"""
+        return hashlib.sha256(text.strip().lower().encode("utf-8")).hexdigest()
+
+    def get_or_compute(self, text: str, compute: Callable[[str], np.ndarray]) -> np.ndarray:
+        """Return the cached embedding for text, computing and storing it on a miss"""
+        key = self.key(text)
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return embedding
+            self.misses += 1
+
+        # Compute outside the lock so concurrent misses don't serialize on the model
+        embedding = compute(text)
+        # Shared between callers, so never let anyone mutate it in place
+        embedding.setflags(write=False)
+
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return embedding
+
+    def clear(self):
+        """Drop all cached embeddings"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+# Process-wide embedding cache shared by every VectorDB instance and tool call
+embedding_cache = EmbeddingCache()
@@ -1,86 +1,160 @@
 #!/usr/bin/env python3
 
 # Standard library imports
-import csv
-import json
+import asyncio
+import hashlib
 import logging
+import re
 import time
+from dataclasses import dataclass, replace
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+# Third-party imports
+import orjson
 
 # Local imports
+from data_processor import read_conversations
 from jtcg_agent import JTCGCRMAgent
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Default number of conversations run against the agent at once
+DEFAULT_AGENT_WORKERS = 8
+
+# A URL or a markdown link target anywhere in the transcript
+SOURCE_LINK_RE = re.compile(r"https?://|\]\(", re.IGNORECASE)
+BRAND_RE = re.compile(r"jtcg", re.IGNORECASE)
+
+# Columns of the manual-review CSV, in order
+RESULT_FIELDNAMES = [
+    "conversation_id",
+    "user_message",
+    "agent_response",
+    "response_time",
+    "success",
+    "error",
+    "within_scope",
+    "correct_content",
+    "brand_voice",
+    "has_source_links",
+    "actionable_next_steps",
+    "overall_rating",
+    "manual_review_notes"
+]
+
+# Free-text columns flattened onto one line before writing
+MULTILINE_FIELDS = frozenset({"user_message", "agent_response", "error", "manual_review_notes"})
+
+# Keep every CSV cell on one line: escape newlines, flatten tabs
+CSV_ESCAPES = str.maketrans({'\n': '\\n', '\r': '\\r', '\t': ' '})
+
+@dataclass(slots=True)
+class ConversationResult:
+    """One tested conversation and its review fields"""
+    conversation_id: int
+    user_message: str = ""
+    agent_response: str = ""
+    chat_history: str = ""
+    # Wall-clock seconds for the agent's reply; with several conversations running at once this
+    # includes time spent waiting on the others (see run_all_tests_async)
+    response_time: float = 0.0
+    success: bool = False
+    error: Optional[str] = None
+    # Review fields, filled by evaluate_response_quality, the LLM judge or a reviewer
+    within_scope: Optional[bool] = None
+    correct_content: Optional[bool] = None
+    reasoning: str = ""
+    # The LLM judge failed; within_scope and correct_content are then None, not a verdict
+    judge_error: bool = False
+    brand_voice: Optional[bool] = None
+    has_source_links: Optional[bool] = None
+    actionable_next_steps: Optional[bool] = None
+    overall_rating: Optional[int] = None
+    manual_review_notes: str = ""
+    # conversation_id of an identical conversation whose agent result this reuses
+    duplicate_of: Optional[int] = None
+
+    def update(self, values: Dict[str, Any]):
+        """Set fields from a dict such as a judge verdict; unknown names raise AttributeError"""
+        for name, value in values.items():
+            setattr(self, name, value)
+
+def _message_text(message: Dict) -> Optional[str]:
+    """Text of a conversation message's first content part, or None if it has no content"""
+    content = message.get("content")
+    return content[0].get("text", "") if content else None
+
+def _quote_all_row(values) -> bytes:
+    """One CSV line with every cell quoted, byte-identical to csv.writer(quoting=QUOTE_ALL)
+
+    Every cell is quoted anyway, so encoding once and doubling quotes is much
+    cheaper than letting csv scan each (often multi-KB, non-ASCII) cell.
+    """
+    return b",".join(b'"' + ("" if value is None else str(value)).encode("utf-8").replace(b'"', b'""') + b'"'
+                     for value in values) + b"\r\n"
+
 class ConversationTester:
     def __init__(self, openai_api_key: str, output_file: str = "conversation_results.csv"):
-        self.agent = JTCGCRMAgent(openai_api_key)
+        # No response cache: results must not depend on which conversations ran earlier
+        self.agent = JTCGCRMAgent(openai_api_key, semantic_cache=False)
         self.agent_functions = self.agent.agent_functions  # Access to detect_intent
         self.output_file = output_file
         self.results = []
 
     def load_test_conversations(self, json_path: str) -> List[List[Dict]]:
-        """Load test conversations from JSON file"""
-        with open(json_path, 'r', encoding='utf-8') as f:
-            conversations = json.load(f)
-        return conversations
+        """Load test conversations from JSON file (parsed once per process, shared read-only)"""
+        return read_conversations(json_path)
 
-    def test_single_conversation(self, conversation: List[Dict], conversation_id: int) -> Dict[str, Any]:
+    def test_single_conversation(self, conversation: List[Dict], conversation_id: int) -> ConversationResult:
         """Test a single conversation and return results"""
+        # Blocking wrapper, reusing this thread's event loop like Runner.run_sync
+        return asyncio.get_event_loop().run_until_complete(
+            self.test_single_conversation_async(conversation, conversation_id))
+
+    async def test_single_conversation_async(self, conversation: List[Dict], conversation_id: int) -> ConversationResult:
+        """Async version of test_single_conversation, so conversations can run concurrently"""
         try:
             # Extract user messages from conversation
             if not conversation or len(conversation) == 0:
-                return {
-                    "conversation_id": conversation_id,
-                    "user_message": "",
-                    "agent_response": "ERROR: Empty conversation",
-                    "chat_history": "ERROR: Empty conversation",
-                    "response_time": 0,
-                    "success": False,
-                    "error": "Empty conversation"
-                }
-
-            # Collect all user messages and last agent response
+                return ConversationResult(
+                    conversation_id=conversation_id,
+                    user_message="",
+                    agent_response="ERROR: Empty conversation",
+                    chat_history="ERROR: Empty conversation",
+                    response_time=0,
+                    success=False,
+                    error="Empty conversation"
+                )
+
+            # Collect all user messages and the formatted chat history in one pass
             user_messages = []
-            last_agent_response = ""
+            chat_history_parts = []
 
             for message in conversation:
-                if message.get("role") == "user":
-                    content = message.get("content", [])
-                    if content and len(content) > 0:
-                        user_messages.append(content[0].get("text", ""))
-                elif message.get("role") == "assistant":
-                    content = message.get("content", [])
-                    if content and len(content) > 0:
-                        last_agent_response = content[0].get("text", "")
+                text = _message_text(message)
+                if text is None:
+                    continue
+                role = message.get("role")
+                if role == "user":
+                    user_messages.append(text)
+                    chat_history_parts.append(f"User: {text}")
+                elif role == "assistant":
+                    chat_history_parts.append(f"Assistant: {text}")
 
             if not user_messages:
-                return {
-                    "conversation_id": conversation_id,
-                    "user_message": "No user message found",
-                    "agent_response": "ERROR: No user message in conversation",
-                    "chat_history": "ERROR: No user message in conversation",
-                    "response_time": 0,
-                    "success": False,
-                    "error": "No user message found"
-                }
-
-            # Create formatted chat history
-            chat_history_parts = []
-
-            for message in conversation:
-                role = message.get("role", "")
-                content = message.get("content", [])
-                if content and len(content) > 0:
-                    text = content[0].get("text", "")
-                    if role == "user":
-                        chat_history_parts.append(f"User: {text}")
-                    elif role == "assistant":
-                        chat_history_parts.append(f"Assistant: {text}")
+                return ConversationResult(
+                    conversation_id=conversation_id,
+                    user_message="No user message found",
+                    agent_response="ERROR: No user message in conversation",
+                    chat_history="ERROR: No user message in conversation",
+                    response_time=0,
+                    success=False,
+                    error="No user message found"
+                )
 
             # For evaluation, get agent response to the last user message
             last_user_message = user_messages[-1] if user_messages else ""
@@ -88,7 +162,7 @@ class ConversationTester:
             # Reset agent state for new conversation
             self.agent.reset_conversation()
 
-            # Measure response time
+            # Measure response time (wall clock, so it includes any wait for other conversations)
             start_time = time.time()
 
             # Use proper conversation input list for multi-turn conversations
@@ -100,19 +174,19 @@ class ConversationTester:
                         conversation_input = []
 
                         # Process all messages except the last one
-                        for i, message in enumerate(conversation[:-1]):
-                            role = message.get("role", "")
-                            content = message.get("content", [])
-                            if content and len(content) > 0:
-                                text = content[0].get("text", "")
-
-                                if role == "user":
-                                    # Detect intent for user messages
-                                    intent = self.agent_functions.detect_intent(text)
-                                    contextual_message = f"[用戶意圖: {intent}] {text}"
-                                    conversation_input.append({"role": "user", "content": contextual_message})
-                                elif role == "assistant":
-                                    conversation_input.append({"role": "assistant", "content": text})
+                        for message in conversation[:-1]:
+                            text = _message_text(message)
+                            if text is None:
+                                continue
+                            role = message.get("role")
+
+                            if role == "user":
+                                # Detect intent for user messages
+                                intent = self.agent_functions.detect_intent(text)
+                                contextual_message = f"[用戶意圖: {intent}] {text}"
+                                conversation_input.append({"role": "user", "content": contextual_message})
+                            elif role == "assistant":
+                                conversation_input.append({"role": "assistant", "content": text})
 
                         # Add the final user message
                         intent = self.agent_functions.detect_intent(last_user_message)
@@ -120,10 +194,10 @@ class ConversationTester:
                         conversation_input.append({"role": "user", "content": contextual_message})
 
                         # Call agent with conversation history using input list
-                        agent_response = self.agent.chat(last_user_message, conversation_input=conversation_input)
+                        agent_response = await self.agent.achat(last_user_message, conversation_input=conversation_input)
                     else:
                         # Single-round conversation: no history needed
-                        agent_response = self.agent.chat(last_user_message)
+                        agent_response = await self.agent.achat(last_user_message)
 
                     # Add agent response to chat history
                     chat_history_parts.append(f"JTCG Agent: {agent_response}")
@@ -143,28 +217,28 @@ class ConversationTester:
             # Format complete chat history
             full_chat_history = "\\n".join(chat_history_parts)
 
-            return {
-                "conversation_id": conversation_id,
-                "user_message": full_chat_history,  # Complete conversation history
-                "agent_response": agent_response,  # Final JTCG agent response only
-                "chat_history": full_chat_history,  # Keep for LLM judge evaluation
-                "response_time": response_time,
-                "success": success,
-                "error": error
-            }
+            return ConversationResult(
+                conversation_id=conversation_id,
+                user_message=full_chat_history,  # Complete conversation history
+                agent_response=agent_response,  # Final JTCG agent response only
+                chat_history=full_chat_history,  # Keep for LLM judge evaluation
+                response_time=response_time,
+                success=success,
+                error=error
+            )
 
         except Exception as e:
-            return {
-                "conversation_id": conversation_id,
-                "user_message": "ERROR parsing conversation",
-                "agent_response": f"ERROR: {str(e)}",
-                "chat_history": f"ERROR parsing conversation: {str(e)}",
-                "response_time": 0,
-                "success": False,
-                "error": str(e)
-            }
-
-    def evaluate_response_quality(self, result: Dict[str, Any]) -> Dict[str, Any]:
+            return ConversationResult(
+                conversation_id=conversation_id,
+                user_message="ERROR parsing conversation",
+                agent_response=f"ERROR: {str(e)}",
+                chat_history=f"ERROR parsing conversation: {str(e)}",
+                response_time=0,
+                success=False,
+                error=str(e)
+            )
+
+    def evaluate_response_quality(self, result: ConversationResult) -> Dict[str, Any]:
         """Add manual evaluation fields for response quality assessment"""
         # This creates fields that need to be manually reviewed
         evaluation = {
@@ -177,63 +251,128 @@ class ConversationTester:
             "overall_rating": None  # 1-5 - 整體評分
         }
 
-        # Auto-detect some basic qualities
-        chat_history = result.get("chat_history", "").lower()
+        # Auto-detect some basic qualities (case-insensitive patterns, no lowercased copy)
+        chat_history = result.chat_history
 
         # Check for source links in the JTCG Agent responses
-        if "http" in chat_history or "[" in chat_history and "](" in chat_history:
-            evaluation["has_source_links"] = True
-        else:
-            evaluation["has_source_links"] = False
+        evaluation["has_source_links"] = bool(SOURCE_LINK_RE.search(chat_history))
 
         # Check for JTCG brand mentions
-        if "jtcg" in chat_history:
+        if BRAND_RE.search(chat_history):
             evaluation["brand_voice"] = True
 
         return evaluation
 
     def run_all_tests(self, conversations_path: str = "ref_data/ai-eng-test-sample-conversations.json",
-                     max_conversations: int = None, start_from: int = 0) -> List[Dict[str, Any]]:
-        """Run tests on all conversations"""
+                     max_conversations: int = None, start_from: int = 0,
+                     workers: int = DEFAULT_AGENT_WORKERS, skip_ids: Set[int] = frozenset()) -> List[ConversationResult]:
+        """Run tests on all conversations
+
+        conversation_id is the 1-based position in the conversations file, so ids stay
+        stable across runs with different start_from; ids in skip_ids are not run.
+        """
+        return asyncio.get_event_loop().run_until_complete(
+            self.run_all_tests_async(conversations_path, max_conversations, start_from, workers, skip_ids))
+
+    async def run_all_tests_async(self, conversations_path: str = "ref_data/ai-eng-test-sample-conversations.json",
+                                  max_conversations: int = None, start_from: int = 0,
+                                  workers: int = DEFAULT_AGENT_WORKERS, skip_ids: Set[int] = frozenset(),
+                                  on_result: Optional[Callable[[ConversationResult], Awaitable[ConversationResult]]] = None
+                                  ) -> List[ConversationResult]:
+        """Async version of run_all_tests
+
+        on_result, if given, is awaited with each result as soon as its conversation
+        finishes (outside the agent concurrency limit) and its return value is kept
+        in place of the result, so callers can process results while others still run.
+
+        With workers > 1 the conversations share one agent and event loop, and the
+        agent's tools are synchronous, so a conversation's response_time also counts
+        time spent blocked on the others. Only workers=1 gives response times
+        comparable with sequential baseline runs.
+        """
         logger.info("Loading test conversations...")
         conversations = self.load_test_conversations(conversations_path)
 
         # Apply start_from offset
         conversations = conversations[start_from:]
 
-        total_conversations = len(conversations)
         if max_conversations:
             conversations = conversations[:max_conversations]
-            total_conversations = len(conversations)
 
-        logger.info(f"Testing {total_conversations} conversations (starting from #{start_from + 1})...")
+        jobs = [(start_from + i, conversation) for i, conversation in enumerate(conversations, 1)
+                if start_from + i not in skip_ids]
+        if len(jobs) < len(conversations):
+            logger.info(f"Skipping {len(conversations) - len(jobs)} conversations that already have results")
+
+        logger.info(f"Testing {len(jobs)} conversations (starting from #{start_from + 1}) "
+                    f"with up to {workers} running at once...")
+        if workers > 1:
+            logger.info("Response times are wall-clock under concurrency; "
+                        "use 1 worker for times comparable with sequential runs")
 
-        results = []
-        for i, conversation in enumerate(conversations, 1):
-            logger.info(f"Processing conversation {i}/{total_conversations}")
+        results = await self._run_conversations(jobs, workers, on_result)
+
+        self.results = results
+        return results
 
+    async def _run_conversations(self, jobs: List[Tuple[int, List[Dict]]], concurrency: int,
+                                 on_result=None) -> List[ConversationResult]:
+        """Test (conversation_id, conversation) jobs concurrently on the shared agent, keeping input order
+
+        Identical conversations run through the agent once; the copies reuse that
+        result, including its response_time, with duplicate_of set to the original's id.
+        """
+        total_conversations = len(jobs)
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+        results = [None] * total_conversations
+        agent_runs = {}  # conversation digest -> task testing its first occurrence
+        done = 0
+        success_count = 0
+        response_time_sum = 0.0
+
+        async def test_one(conversation: List[Dict], conversation_id: int) -> ConversationResult:
             # Test the conversation
-            result = self.test_single_conversation(conversation, i)
+            async with semaphore:
+                result = await self.test_single_conversation_async(conversation, conversation_id)
 
             # Add evaluation fields
             evaluation = self.evaluate_response_quality(result)
             result.update(evaluation)
-
-            results.append(result)
+            return result
+
+        async def run_one(position: int, conversation_id: int, conversation: List[Dict]):
+            nonlocal done, success_count, response_time_sum
+            logger.debug(f"Processing conversation {conversation_id} ({position + 1}/{total_conversations})")
+
+            digest = hashlib.blake2b(orjson.dumps(conversation, option=orjson.OPT_SORT_KEYS), digest_size=16).digest()
+            first_run = agent_runs.get(digest)
+            if first_run is None:
+                agent_runs[digest] = first_run = asyncio.ensure_future(test_one(conversation, conversation_id))
+            # Copy, so on_result can modify each row independently
+            result = replace(await first_run)
+            if result.conversation_id != conversation_id:
+                # Keep the original's response_time so latency averages aren't pulled down
+                result = replace(result, conversation_id=conversation_id, duplicate_of=result.conversation_id)
+
+            done += 1
+            success_count += result.success
+            response_time_sum += result.response_time
 
             # Log progress every 10 conversations
-            if i % 10 == 0:
-                success_rate = sum(1 for r in results if r["success"]) / len(results) * 100
-                avg_time = sum(r["response_time"] for r in results) / len(results)
-                logger.info(f"Progress: {i}/{total_conversations} - Success rate: {success_rate:.1f}% - Avg time: {avg_time:.2f}s")
+            if done % 10 == 0:
+                success_rate = success_count / done * 100
+                avg_time = response_time_sum / done
+                logger.info(f"Progress: {done}/{total_conversations} - Success rate: {success_rate:.1f}% - Avg time: {avg_time:.2f}s")
 
-            # Small delay to avoid rate limiting
-            time.sleep(0.1)
+            results[position] = await on_result(result) if on_result is not None else result
 
-        self.results = results
+        await asyncio.gather(*(run_one(position, conversation_id, conversation)
+                               for position, (conversation_id, conversation) in enumerate(jobs)))
+        if len(agent_runs) < total_conversations:
+            logger.info(f"Reused agent results for {total_conversations - len(agent_runs)} duplicate conversations")
         return results
 
-    def save_results_to_csv(self, results: List[Dict[str, Any]], filename: str = None):
+    def save_results_to_csv(self, results: List[ConversationResult], filename: str = None):
         """Save test results to CSV file for manual review"""
         if not filename:
             filename = self.output_file
@@ -242,65 +381,48 @@ class ConversationTester:
         output_path = Path(filename)
         output_path.parent.mkdir(exist_ok=True)
 
-        fieldnames = [
-            "conversation_id",
-            "user_message",
-            "agent_response",
-            "response_time",
-            "success",
-            "error",
-            "within_scope",
-            "correct_content",
-            "brand_voice",
-            "has_source_links",
-            "actionable_next_steps",
-            "overall_rating",
-            "manual_review_notes"
-        ]
-
-        with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames, quoting=csv.QUOTE_ALL)
-            writer.writeheader()
+        with open(filename, 'wb') as csvfile:
+            csvfile.write(_quote_all_row(RESULT_FIELDNAMES))
 
             for result in results:
-                # Prepare row data
-                row = {field: result.get(field, "") for field in fieldnames}
-
-                # Convert multi-line strings to single lines for better CSV viewing
-                def format_for_csv(text):
-                    if not text:
-                        return ""
-                    # Replace newlines with \\n for visual representation
-                    formatted = str(text).replace('\n', '\\n').replace('\r', '\\r')
-                    # Replace tabs with spaces for better readability
-                    formatted = formatted.replace('\t', ' ')
-                    return formatted
-
-                # Format text fields
-                row["user_message"] = format_for_csv(row["user_message"])
-                row["agent_response"] = format_for_csv(row["agent_response"])
-                row["error"] = format_for_csv(row["error"])
-                row["manual_review_notes"] = format_for_csv(row["manual_review_notes"])
-
-                # Keep full text for user_message and agent_response - no truncation
-
-                writer.writerow(row)
+                row = []
+                for field in RESULT_FIELDNAMES:
+                    value = getattr(result, field)
+                    if field in MULTILINE_FIELDS:
+                        # Replace newlines with \\n for visual representation; keep full text, no truncation
+                        value = str(value).translate(CSV_ESCAPES) if value else ""
+                    row.append(value)
+                csvfile.write(_quote_all_row(row))
 
         logger.info(f"Results saved to {filename}")
 
-    def generate_summary_report(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def generate_summary_report(self, results: List[ConversationResult]) -> Dict[str, Any]:
         """Generate a summary report of the test results"""
         total_conversations = len(results)
-        successful_responses = sum(1 for r in results if r["success"])
-        failed_responses = total_conversations - successful_responses
+        successful_responses = 0
+        responses_with_links = 0
+        response_time_sum = 0.0
+        min_response_time = max_response_time = 0
+
+        # Single pass over the results for every count and response-time statistic
+        for r in results:
+            if r.success:
+                response_time = r.response_time
+                if successful_responses == 0:
+                    min_response_time = max_response_time = response_time
+                elif response_time < min_response_time:
+                    min_response_time = response_time
+                elif response_time > max_response_time:
+                    max_response_time = response_time
+                successful_responses += 1
+                response_time_sum += response_time
+
+            # Count responses with source links
+            if r.has_source_links:
+                responses_with_links += 1
 
-        response_times = [r["response_time"] for r in results if r["success"]]
-        avg_response_time = sum(response_times) / len(response_times) if response_times else 0
-        max_response_time = max(response_times) if response_times else 0
-        min_response_time = min(response_times) if response_times else 0
-
-        # Count responses with source links
-        responses_with_links = sum(1 for r in results if r.get("has_source_links"))
+        failed_responses = total_conversations - successful_responses
+        avg_response_time = response_time_sum / successful_responses if successful_responses else 0
 
         report = {
             "test_date": datetime.now().isoformat(),
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+from handover_simple_mock import EMAIL_RE, handover_simple
+
+def test_email_validation():
+    """Test the handover email check, including Unicode whitespace and trailing newlines"""
+    valid_emails = [
+        "user@example.com",
+        "first.last+tag@mail.example.com.tw",
+    ]
+    invalid_emails = [
+        "",
+        "bad-email",
+        "user@example",
+        "user@@example.com",
+        "user@example.com\n",  # a trailing newline, which ^...$ with re.match let through
+        "a\u3000b@c.com",  # ideographic space inside the local part
+        "a@b.com\u3000",  # trailing ideographic space
+        "\u00a0a@b.com",  # leading no-break space
+        "a@b.com\u00a0",  # trailing no-break space
+        "a@b.c trailing junk",  # an email followed by more text
+        "junk a@b.c",
+    ]
+
+    print("Testing email validation:")
+    for email in valid_emails:
+        assert EMAIL_RE.fullmatch(email), f"rejected valid email {email!r}"
+        print(f"   valid: {email!r}")
+    for email in invalid_emails:
+        # Anchored, so callers using match or search reject the same strings
+        for check in (EMAIL_RE.fullmatch, EMAIL_RE.match, EMAIL_RE.search):
+            assert not check(email), f"accepted invalid email {email!r}"
+        print(f"   invalid: {email!r}")
+
+    print("\nTesting handover_simple:")
+    assert handover_simple("JTCG-CHAT-0001", "user@example.com", "使用者希望轉接真人") == "已為您轉接真人"
+    assert handover_simple("FAIL-0002", "user@example.com", "使用者希望轉接真人") != "已為您轉接真人"
+    assert handover_simple("JTCG-CHAT-0003", "a@b.com\u3000", "使用者希望轉接真人") != "已為您轉接真人"
+    print("   Handover results as expected")
+
+    print("\nAll tests passed!")
+
+if __name__ == "__main__":
+    test_email_validation()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+import asyncio
+import csv
+import os
+import tempfile
+
+from run_full_evaluation import (EVALUATION_FIELDNAMES, EvaluationCSVWriter, EvaluationStats, JudgeCache,
+                                 LLMJudgeEvaluator)
+from test_conversations import ConversationResult, ConversationTester
+
+def _conversation(text):
+    return [{"role": "user", "content": [{"type": "input_text", "text": text}]}]
+
+def _offline_tester(conversations):
+    """A ConversationTester without an agent, counting which conversation ids reach it"""
+    tester = ConversationTester.__new__(ConversationTester)
+    tester.results = []
+    tester.load_test_conversations = lambda json_path: conversations
+    tester.agent_calls = []
+
+    async def test_single_conversation_async(conversation, conversation_id):
+        tester.agent_calls.append(conversation_id)
+        return ConversationResult(conversation_id=conversation_id,
+                                  user_message=conversation[0]["content"][0]["text"],
+                                  response_time=float(conversation_id), success=True)
+
+    tester.test_single_conversation_async = test_single_conversation_async
+    return tester
+
+def test_parse_evaluation():
+    """Test that the first JSON object in a free-text judge reply is taken as the verdict"""
+    evaluator = LLMJudgeEvaluator.__new__(LLMJudgeEvaluator)
+    evaluator.cache = None
+
+    print("Testing judge reply parsing:")
+    replies = [
+        'Verdict: {"within_scope": true, "correct_content": false, "reasoning": "ok"} '
+        '(schema was {within_scope, correct_content})',
+        'Format {within_scope}: ```json\n{"within_scope": true, "correct_content": false, '
+        '"reasoning": "brace } in \\"text\\""}\n``` {"within_scope": false}',
+    ]
+    for reply in replies:
+        verdict = evaluator._parse_evaluation(reply)
+        assert "judge_error" not in verdict, verdict
+        assert (verdict["within_scope"], verdict["correct_content"]) == (True, False)
+        print(f"   Parsed: {verdict['reasoning']!r}")
+
+    for reply in ("I cannot evaluate this.", '{"within_scope": "yes", "correct_content": false, "reasoning": ""}'):
+        assert evaluator._parse_evaluation(reply)["judge_error"] is True
+    print("   Unusable replies marked as judge errors")
+
+def test_evaluation_stats():
+    """Test that failed judgments are left out of both accuracy rates"""
+    stats = EvaluationStats()
+    stats.add(ConversationResult(conversation_id=1, success=True, within_scope=True, correct_content=False))
+    # A verdict left on a row the judge then failed on must not count
+    stats.add(ConversationResult(conversation_id=2, success=True, within_scope=True, correct_content=True,
+                                 judge_error=True))
+
+    print("\nTesting evaluation stats:")
+    summary = stats.summary()
+    assert (summary["within_scope_count"], summary["correct_content_count"]) == (1, 0)
+    assert (summary["within_scope_rate"], summary["correct_content_rate"]) == (100, 0)
+    assert summary["judge_errors"] == 1
+    print(f"   {summary['judge_errors']} judge error excluded")
+
+def test_judge_cache():
+    """Test that cached verdicts are returned until they are older than the TTL"""
+    verdict = {"within_scope": True, "correct_content": False, "reasoning": "缺少保固資訊"}
+
+    print("\nTesting judge cache:")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "judge_cache.sqlite")
+        key = JudgeCache.key("gpt-4o-mini", "instructions", "transcript")
+        assert key != JudgeCache.key("gpt-4o-mini", "instructions", "another transcript")
+        assert key != JudgeCache.key("gpt-4o-mini", "instructionstranscript", "")
+
+        cache = JudgeCache(path, ttl=3600)
+        assert cache.get(key) is None
+        cache.set(key, verdict)
+        assert cache.get(key) == verdict
+        cache.close()
+        print("   Verdict cached")
+
+        # A new run reads the verdict back from disk
+        cache = JudgeCache(path, ttl=3600)
+        assert cache.get(key) == verdict
+        cache.close()
+        print("   Verdict reused across runs")
+
+        # Once older than the TTL it is neither returned nor kept
+        cache = JudgeCache(path, ttl=-1)
+        assert cache.get(key) is None
+        cache.close()
+        cache = JudgeCache(path, ttl=3600)
+        assert cache.get(key) is None
+        cache.close()
+        print("   Expired verdict dropped")
+
+def test_resume():
+    """Test that a resumed evaluation keeps earlier rows and only runs the missing ids"""
+    conversations = [_conversation(f"問題 {i}") for i in range(1, 6)]
+
+    print("\nTesting resume:")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "evaluation.csv")
+        with EvaluationCSVWriter(filename) as writer:
+            for conversation_id in (1, 3):
+                writer.writerow(ConversationResult(conversation_id=conversation_id, agent_response="line\nbreak",
+                                                   response_time=2.0, success=True,
+                                                   within_scope=True, correct_content=conversation_id == 1))
+
+        with EvaluationCSVWriter(filename, resume=True) as writer:
+            assert writer.completed_ids == {1, 3}
+            summary = writer.stats.summary()
+            assert summary["total_conversations"] == 2
+            assert summary["correct_content_count"] == 1
+            print(f"   Resumed with ids {sorted(writer.completed_ids)}")
+
+            tester = _offline_tester(conversations)
+            results = asyncio.run(tester.run_all_tests_async(skip_ids=writer.completed_ids))
+            assert tester.agent_calls == [2, 4, 5]
+            assert [result.conversation_id for result in results] == [2, 4, 5]
+            for result in results:
+                writer.writerow(result)
+            print(f"   Ran only ids {tester.agent_calls}")
+
+        with EvaluationCSVWriter(filename, resume=True) as writer:
+            assert writer.completed_ids == {1, 2, 3, 4, 5}
+            assert writer.stats.summary()["total_conversations"] == 5
+        with open(filename, encoding="utf-8") as csvfile:
+            assert len(csvfile.readlines()) == 6  # header + one line per row
+
+        # start_from keeps ids stable, so a resumed slice skips the same conversations
+        tester = _offline_tester(conversations)
+        asyncio.run(tester.run_all_tests_async(start_from=2, skip_ids={3, 5}))
+        assert tester.agent_calls == [4]
+        print("   Ids stay stable with start_from")
+
+        # Files from before the judge_error column keep their own layout
+        old_header = [field for field in EVALUATION_FIELDNAMES if field != "judge_error"]
+        filename = os.path.join(tmpdir, "old_layout.csv")
+        with open(filename, "w", newline="", encoding="utf-8") as csvfile:
+            csvwriter = csv.writer(csvfile)
+            csvwriter.writerow(old_header)
+            csvwriter.writerow(["1", "q", "a", "1.5", "True", "", "True", "True", "ok", "True", "True", "", "", ""])
+        with EvaluationCSVWriter(filename, resume=True) as writer:
+            writer.writerow(ConversationResult(conversation_id=2, success=True, within_scope=None,
+                                               correct_content=None, judge_error=True, has_source_links=True))
+        with open(filename, newline="", encoding="utf-8") as csvfile:
+            rows = list(csv.DictReader(csvfile))
+        assert all(list(row) == old_header for row in rows)
+        assert rows[1]["has_source_links"] == "True" and rows[1]["brand_voice"] == ""
+        with EvaluationCSVWriter(filename, resume=True) as writer:
+            summary = writer.stats.summary()
+        assert summary["responses_with_source_links"] == 2
+        assert summary["judge_errors"] == 1 and summary["within_scope_rate"] == 100
+        print("   Old column layout kept on resume")
+
+def test_resume_damaged_file():
+    """Test that resuming skips rows cut off by a crash and refuses unknown layouts"""
+    print("\nTesting resume after a crash:")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, "evaluation.csv")
+        with EvaluationCSVWriter(filename) as writer:
+            for conversation_id in (1, 2, 3):
+                writer.writerow(ConversationResult(conversation_id=conversation_id, agent_response="回覆",
+                                                   success=True, within_scope=True, correct_content=True))
+        with open(filename, "rb") as csvfile:
+            content = csvfile.read()
+        # Cut row 3 mid-write, and add a row with too few cells
+        last_row = content.rindex(b"\n", 0, len(content) - 1) + 1
+        with open(filename, "wb") as csvfile:
+            csvfile.write(content[:last_row] + b"4,q,a\r\n" + content[last_row:last_row + 3])
+
+        with EvaluationCSVWriter(filename, resume=True) as writer:
+            assert writer.completed_ids == {1, 2}
+            assert writer.stats.summary()["total_conversations"] == 2
+            writer.writerow(ConversationResult(conversation_id=3, success=True, within_scope=True))
+        with EvaluationCSVWriter(filename, resume=True) as writer:
+            assert writer.completed_ids == {1, 2, 3}
+        print(f"   Resumed with ids {sorted(writer.completed_ids)}")
+
+        with open(filename, "w", newline="", encoding="utf-8") as csvfile:
+            csv.writer(csvfile).writerows([["conversation_id", "score"], ["1", "5"]])
+        try:
+            EvaluationCSVWriter(filename, resume=True)
+        except ValueError as e:
+            print(f"   Refused: {e}")
+        else:
+            raise AssertionError("resumed a file with another column layout")
+        with open(filename, encoding="utf-8") as csvfile:
+            assert csvfile.read() == "conversation_id,score\n1,5\n"
+
+def test_dedup_mapping():
+    """Test that identical conversations run through the agent once and map back to the first id"""
+    conversations = [_conversation("退貨流程"), _conversation("保固多久"),
+                     _conversation("退貨流程"), _conversation("退貨流程")]
+
+    print("\nTesting duplicate conversations:")
+    tester = _offline_tester(conversations)
+    results = asyncio.run(tester.run_all_tests_async(workers=2))
+    assert sorted(tester.agent_calls) == [1, 2]
+    assert [result.conversation_id for result in results] == [1, 2, 3, 4]
+    assert [result.duplicate_of for result in results] == [None, None, 1, 1]
+    # Copies keep the original's timing and content, as separate objects
+    assert [result.response_time for result in results] == [1.0, 2.0, 1.0, 1.0]
+    assert results[2].user_message == results[0].user_message == "退貨流程"
+    assert results[2] is not results[0] and results[3] is not results[2]
+    for result in results:
+        print(f"   #{result.conversation_id}: duplicate_of={result.duplicate_of}")
+
+    print("\nAll tests passed!")
+
+if __name__ == "__main__":
+    test_parse_evaluation()
+    test_evaluation_stats()
+    test_judge_cache()
+    test_resume()
+    test_resume_damaged_file()
+    test_dedup_mapping()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from semantic_cache import EmbeddingCache, SemanticCache
+
+def test_semantic_cache():
+    """Test similarity lookups, the tau threshold and eviction of the response cache"""
+    cache = SemanticCache(tau=0.9, max_entries=2)
+
+    print("Testing semantic cache:")
+    assert cache.lookup([1.0, 0.0, 0.0]) is None
+    cache.insert([1.0, 0.0, 0.0], "退換貨政策", "reply-return")
+    cache.insert([0.0, 1.0, 0.0], "保固多久", "reply-warranty")
+
+    # Same direction at a different scale: cosine similarity 1
+    hit = cache.lookup([2.0, 0.0, 0.0])
+    assert hit is not None and hit.response == "reply-return"
+    print(f"   Hit: {hit.message} ({hit.similarity:.2f})")
+
+    # Cosine similarity ~0.71, below tau
+    assert cache.lookup([1.0, 1.0, 0.0]) is None
+    assert cache.lookup([1.0, 1.0, 0.0], tau=0.7) is not None
+    print("   Below-threshold lookup missed as expected")
+
+    # A third entry evicts the oldest one
+    cache.insert([0.0, 0.0, 1.0], "發票", "reply-invoice")
+    assert len(cache) == 2
+    assert cache.lookup([1.0, 0.0, 0.0]) is None
+    assert cache.lookup([0.0, 0.0, 1.0]).response == "reply-invoice"
+    print(f"   Oldest entry evicted, {len(cache)} entries left")
+
+    cache.clear()
+    assert len(cache) == 0 and cache.lookup([0.0, 1.0, 0.0]) is None
+
+def test_embedding_cache():
+    """Test key normalization, LRU eviction and hit counting of the embedding cache"""
+    cache = EmbeddingCache(max_entries=2)
+    computed = []
+
+    def compute(text):
+        computed.append(text)
+        return np.full(3, len(computed), dtype=np.float32)
+
+    print("\nTesting embedding cache:")
+    first = cache.get_or_compute("Dual Monitor Arm", compute)
+    # The embedding model is uncased, so case and outer whitespace share an entry
+    again = cache.get_or_compute("  dual monitor arm ", compute)
+    assert again is first and computed == ["Dual Monitor Arm"]
+    assert not first.flags.writeable
+    print(f"   Hits: {cache.hits}, misses: {cache.misses}")
+
+    cache.get_or_compute("vesa", compute)
+    cache.get_or_compute("dual monitor arm", compute)  # refreshes the entry, so "vesa" is now oldest
+    cache.get_or_compute("warranty", compute)
+    cache.get_or_compute("vesa", compute)
+    assert computed == ["Dual Monitor Arm", "vesa", "warranty", "vesa"]
+    assert (cache.hits, cache.misses) == (2, 4)
+    print(f"   Hit ratio after eviction: {cache.hit_ratio:.2f}")
+
+    cache.clear()
+    assert len(cache) == 0 and cache.hit_ratio == 0.0
+
+    print("\nAll tests passed!")
+
+if __name__ == "__main__":
+    test_semantic_cache()
+    test_embedding_cache()
@@ -1,5 +1,10 @@
 #!/usr/bin/env python3
 
+import tempfile
+
+from chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2 import ONNXMiniLM_L6_V2
+
+import vector_db as vector_db_module
 from data_processor import DataProcessor
 from vector_db import VectorDB
 
@@ -53,5 +58,37 @@ def test_vector_db():
 
     print("\nVector database tests completed!")
 
+def test_shared_embedding_model():
+    """Populating and searching must embed with the process-wide model, never load a new one"""
+    print("\nTesting shared embedding model...")
+    processor = DataProcessor()
+    processor.load_knowledge_base("ref_data/ai-eng-test-sample-knowledges.csv")
+    processor.load_products("ref_data/ai-eng-test-sample-products.csv")
+    shared_model = vector_db_module._get_onnx_model()
+
+    # Chroma's DefaultEmbeddingFunction constructs a new ONNXMiniLM_L6_V2 per call
+    loads = []
+    original_init = ONNXMiniLM_L6_V2.__init__
+
+    def counting_init(self, *args, **kwargs):
+        loads.append(self)
+        original_init(self, *args, **kwargs)
+
+    ONNXMiniLM_L6_V2.__init__ = counting_init
+    try:
+        # A fresh database, so every item is embedded
+        with tempfile.TemporaryDirectory() as db_path:
+            vector_db = VectorDB(db_path=db_path)
+            vector_db.initialize_with_data(processor)
+            vector_db.search_knowledge("退換貨政策", n_results=1)
+            vector_db.search_products("雙螢幕臂架", n_results=1)
+    finally:
+        ONNXMiniLM_L6_V2.__init__ = original_init
+
+    print(f"Embedding models loaded while populating and searching: {len(loads)}")
+    assert not loads, "populate/search loaded a new embedding model instead of the shared one"
+    assert vector_db_module._get_onnx_model() is shared_model
+
 if __name__ == "__main__":
-    test_vector_db()
\ No newline at end of file
+    test_vector_db()
+    test_shared_embedding_model()
\ No newline at end of file
@@ -1,9 +1,78 @@
 import chromadb
 from chromadb.config import Settings
-from typing import List, Dict, Any, Optional
+from chromadb.utils import embedding_functions
+from chromadb.utils.embedding_functions.onnx_mini_lm_l6_v2 import ONNXMiniLM_L6_V2
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 import hashlib
-import json
+import os
+import sqlite3
+import threading
+from contextlib import closing
+import numpy as np
+import orjson
 from data_processor import DataProcessor, KnowledgeItem, Product
+from semantic_cache import embedding_cache
+
+# HNSW index settings for both collections. With cosine distance, 1 - distance is the
+# cosine similarity that agent_functions reports as relevance_score
+HNSW_CONFIGURATION = {
+    "space": "cosine",
+    "max_neighbors": 16,
+    "ef_construction": 200,
+    "ef_search": 100
+}
+
+# ONNX Runtime providers per embedding device (pick with JTCG_EMBEDDING_DEVICE).
+# "auto" lets ONNX Runtime use every available provider, so CUDA is picked up
+# when onnxruntime-gpu is installed and CPU is used otherwise
+EMBEDDING_DEVICE_PROVIDERS = {
+    "auto": None,
+    "cpu": ["CPUExecutionProvider"],
+    "cuda": ["CUDAExecutionProvider", "CPUExecutionProvider"]
+}
+
+# List-valued metadata (tags, VESA options, includes) is stored joined with this separator,
+# which is cheaper to split on every search hit than JSON is to parse
+LIST_SEPARATOR = "|"
+
+def _split_list(value: str) -> List[str]:
+    return value.split(LIST_SEPARATOR) if value else []
+
+# Everything search_* reads from a query; never ship the stored embeddings back
+QUERY_INCLUDE = ["metadatas", "documents", "distances"]
+
+# Documents per collection.upsert() call while populating, so each call embeds a bounded batch
+UPSERT_BATCH_SIZE = 128
+
+# One ONNX MiniLM model per process; loading it means reading the model and tokenizer from disk
+_onnx_model: Optional[ONNXMiniLM_L6_V2] = None
+_onnx_model_lock = threading.Lock()
+
+def _get_onnx_model() -> ONNXMiniLM_L6_V2:
+    global _onnx_model
+    with _onnx_model_lock:
+        if _onnx_model is None:
+            device = os.getenv("JTCG_EMBEDDING_DEVICE", "auto").lower()
+            if device not in EMBEDDING_DEVICE_PROVIDERS:
+                raise ValueError(f"JTCG_EMBEDDING_DEVICE must be one of {', '.join(EMBEDDING_DEVICE_PROVIDERS)}, got {device!r}")
+            _onnx_model = ONNXMiniLM_L6_V2(preferred_providers=EMBEDDING_DEVICE_PROVIDERS[device])
+        return _onnx_model
+
+class SharedDefaultEmbeddingFunction(embedding_functions.DefaultEmbeddingFunction):
+    """Chroma's default embedder (all-MiniLM-L6-v2) on the process-wide model
+
+    DefaultEmbeddingFunction builds a fresh ONNXMiniLM_L6_V2, and so reloads the
+    model, on every call. This keeps the "default" name, so collections persisted
+    with Chroma's default embedder still match. Because it is a DefaultEmbeddingFunction,
+    Chroma embeds with the one from the persisted collection configuration instead,
+    so VectorDB always passes precomputed embeddings to upsert and query.
+    """
+
+    def __call__(self, input):
+        return _get_onnx_model()(input)
+
+# Shared by every VectorDB instance and both collections
+shared_embedding_function = SharedDefaultEmbeddingFunction()
 
 class VectorDB:
     def __init__(self, db_path: str = "chroma_db"):
@@ -11,41 +80,72 @@ class VectorDB:
             path=db_path,
             settings=Settings(anonymized_telemetry=False)
         )
+        self._enable_wal(db_path)
         self.knowledge_collection = None
         self.products_collection = None
 
+        # Same model the collections embed documents with (all-MiniLM-L6-v2)
+        self.embedding_function = shared_embedding_function
+
+    @staticmethod
+    def _enable_wal(db_path: str):
+        """Switch Chroma's SQLite file to write-ahead logging, which persists in the file itself"""
+        # Ingest then appends to the WAL instead of rewriting a rollback journal per commit
+        try:
+            with closing(sqlite3.connect(os.path.join(db_path, "chroma.sqlite3"), timeout=5)) as conn:
+                conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.Error as e:
+            print(f"Could not enable WAL on the vector database: {e}")
+
+    def embed(self, text: str) -> np.ndarray:
+        """Embed a single text with the collections' embedding model (cached process-wide)"""
+        return embedding_cache.get_or_compute(text, self._embed_uncached)
+
+    def _embed_uncached(self, text: str) -> np.ndarray:
+        return np.asarray(self.embedding_function([text])[0], dtype=np.float32)
+
     def setup_collections(self):
         """Initialize ChromaDB collections for knowledge and products"""
         # Knowledge base collection
-        try:
-            self.knowledge_collection = self.client.get_collection("knowledge_base")
-        except:
-            self.knowledge_collection = self.client.create_collection(
-                name="knowledge_base",
-                metadata={"description": "JTCG knowledge base for FAQ and support"}
-            )
+        self.knowledge_collection = self._open_collection(
+            "knowledge_base", "JTCG knowledge base for FAQ and support"
+        )
 
         # Products collection
-        try:
-            self.products_collection = self.client.get_collection("products")
-        except:
-            self.products_collection = self.client.create_collection(
-                name="products",
-                metadata={"description": "JTCG product catalog"}
-            )
+        self.products_collection = self._open_collection("products", "JTCG product catalog")
+
+    def _open_collection(self, name: str, description: str):
+        """Get a collection, recreating it if it was built with a different distance space or list format"""
+        options = {
+            "configuration": {"hnsw": HNSW_CONFIGURATION},
+            "metadata": {"description": description, "list_separator": LIST_SEPARATOR},
+            "embedding_function": self.embedding_function
+        }
+        # An existing collection comes back as it was created, so check its settings below
+        collection = self.client.get_or_create_collection(name, **options)
+
+        if (
+            collection.configuration.get("hnsw", {}).get("space") != HNSW_CONFIGURATION["space"]
+            or (collection.metadata or {}).get("list_separator") != LIST_SEPARATOR
+        ):
+            # The index is derived from ref_data, so drop it and let populate_* rebuild it
+            print(f"Rebuilding '{name}' collection for the current index settings")
+            self.client.delete_collection(name)
+            collection = self.client.create_collection(name, **options)
+        return collection
 
     def _create_knowledge_document(self, item: KnowledgeItem) -> str:
         """Create a searchable document from knowledge item"""
-        doc_parts = [
+        doc_parts = (
             f"Title: {item.title}",
             f"Content: {item.content}",
             f"Tags: {', '.join(item.tags)}" if item.tags else ""
-        ]
-        return " ".join(part for part in doc_parts if part)
+        )
+        return " ".join(filter(None, doc_parts))
 
     def _create_product_document(self, product: Product) -> str:
         """Create a searchable document from product"""
-        doc_parts = [
+        doc_parts = (
             f"Name: {product.name}",
             f"SKU: {product.sku}",
             f"Type: {product.arm_type}",
@@ -55,20 +155,46 @@ class VectorDB:
             f"Desk: {product.desk_thickness_mm} mm" if product.desk_thickness_mm else "",
             f"Notes: {product.compatibility_notes}" if product.compatibility_notes else "",
             f"Includes: {', '.join(product.includes)}" if product.includes else ""
-        ]
-        return " ".join(part for part in doc_parts if part)
+        )
+        return " ".join(filter(None, doc_parts))
+
+    @staticmethod
+    def _content_hash(document: str, metadata: Dict[str, Any]) -> str:
+        return hashlib.blake2b(orjson.dumps([document, metadata], option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+
+    def _sync_collection(self, collection, documents: List[str], metadatas: List[Dict[str, Any]], ids: List[str]) -> Tuple[int, int]:
+        """Upsert items whose content hash changed and delete ids no longer present; returns (upserted, deleted)"""
+        for document, metadata in zip(documents, metadatas):
+            metadata["content_hash"] = self._content_hash(document, metadata)
+
+        existing = collection.get(include=["metadatas"])
+        stored_hashes = {
+            id_: (metadata or {}).get("content_hash")
+            for id_, metadata in zip(existing["ids"], existing["metadatas"])
+        }
+        changed = [i for i, id_ in enumerate(ids) if stored_hashes.get(id_) != metadatas[i]["content_hash"]]
+
+        for start in range(0, len(changed), UPSERT_BATCH_SIZE):
+            batch = changed[start:start + UPSERT_BATCH_SIZE]
+            batch_documents = [documents[i] for i in batch]
+            collection.upsert(
+                documents=batch_documents,
+                # Embed here: Chroma only calls non-default embedding functions itself
+                embeddings=self.embedding_function(batch_documents),
+                metadatas=[metadatas[i] for i in batch],
+                ids=[ids[i] for i in batch]
+            )
+
+        stale = list(stored_hashes.keys() - set(ids))
+        if stale:
+            collection.delete(ids=stale)
+        return len(changed), len(stale)
 
     def populate_knowledge_base(self, knowledge_items: List[KnowledgeItem]):
         """Populate the knowledge base collection"""
         if not self.knowledge_collection:
             self.setup_collections()
 
-        # Check if already populated
-        existing_count = self.knowledge_collection.count()
-        if existing_count > 0:
-            print(f"Knowledge base already has {existing_count} items. Skipping population.")
-            return
-
         documents = []
         metadatas = []
         ids = []
@@ -83,30 +209,24 @@ class VectorDB:
                 "url_label": item.url_label,
                 "url_href": item.url_href,
                 "image_url": item.image_url,
-                "tags": json.dumps(item.tags),
+                "tags": LIST_SEPARATOR.join(item.tags),
                 "type": "knowledge"
             }
             metadatas.append(metadata)
             ids.append(item.id)
 
-        self.knowledge_collection.add(
-            documents=documents,
-            metadatas=metadatas,
-            ids=ids
-        )
-        print(f"Added {len(documents)} knowledge items to vector database")
+        # Only items whose content changed since the last run are re-embedded
+        upserted, deleted = self._sync_collection(self.knowledge_collection, documents, metadatas, ids)
+        if upserted or deleted:
+            print(f"Upserted {upserted} and deleted {deleted} knowledge items in vector database")
+        else:
+            print(f"Knowledge base already has all {len(ids)} items. Skipping population.")
 
     def populate_products(self, products: List[Product]):
         """Populate the products collection"""
         if not self.products_collection:
             self.setup_collections()
 
-        # Check if already populated
-        existing_count = self.products_collection.count()
-        if existing_count > 0:
-            print(f"Products already has {existing_count} items. Skipping population.")
-            return
-
         documents = []
         metadatas = []
         ids = []
@@ -120,24 +240,32 @@ class VectorDB:
                 "name": product.name,
                 "arm_type": product.arm_type,
                 "size_max_inch": product.size_max_inch,
-                "vesa_options": json.dumps(product.vesa_options),
+                "vesa_options": LIST_SEPARATOR.join(product.vesa_options),
                 "weight_per_arm_kg": product.weight_per_arm_kg,
                 "desk_thickness_mm": product.desk_thickness_mm,
                 "compatibility_notes": product.compatibility_notes,
                 "url": product.url,
                 "image_url": product.image_url,
-                "includes": json.dumps(product.includes),
+                "includes": LIST_SEPARATOR.join(product.includes),
                 "type": "product"
             }
             metadatas.append(metadata)
             ids.append(product.sku)
 
-        self.products_collection.add(
-            documents=documents,
-            metadatas=metadatas,
-            ids=ids
-        )
-        print(f"Added {len(documents)} products to vector database")
+        # Only products whose content changed since the last run are re-embedded
+        upserted, deleted = self._sync_collection(self.products_collection, documents, metadatas, ids)
+        if upserted or deleted:
+            print(f"Upserted {upserted} and deleted {deleted} products in vector database")
+        else:
+            print(f"Products already has all {len(ids)} items. Skipping population.")
+
+    @staticmethod
+    def _hits(results) -> Iterator[Tuple[Dict[str, Any], float, str]]:
+        """(metadata, distance, document) for each hit of a single-query result"""
+        metadatas = results["metadatas"][0] if results["metadatas"] else []
+        distances = results["distances"][0] if results["distances"] else [0] * len(metadatas)
+        documents = results["documents"][0] if results["documents"] else [""] * len(metadatas)
+        return zip(metadatas, distances, documents)
 
     def search_knowledge(self, query: str, n_results: int = 3) -> List[Dict[str, Any]]:
         """Search knowledge base for relevant FAQ items"""
@@ -145,26 +273,24 @@ class VectorDB:
             self.setup_collections()
 
         results = self.knowledge_collection.query(
-            query_texts=[query],
-            n_results=n_results
+            query_embeddings=[self.embed(query)],
+            n_results=n_results,
+            include=QUERY_INCLUDE
         )
 
-        formatted_results = []
-        if results["metadatas"] and results["metadatas"][0]:
-            for i, metadata in enumerate(results["metadatas"][0]):
-                result = {
-                    "id": metadata["id"],
-                    "title": metadata["title"],
-                    "url_label": metadata["url_label"],
-                    "url_href": metadata["url_href"],
-                    "image_url": metadata["image_url"],
-                    "tags": json.loads(metadata["tags"]),
-                    "distance": results["distances"][0][i] if results["distances"] else 0,
-                    "document": results["documents"][0][i] if results["documents"] else ""
-                }
-                formatted_results.append(result)
-
-        return formatted_results
+        return [
+            {
+                "id": metadata["id"],
+                "title": metadata["title"],
+                "url_label": metadata["url_label"],
+                "url_href": metadata["url_href"],
+                "image_url": metadata["image_url"],
+                "tags": _split_list(metadata["tags"]),
+                "distance": distance,
+                "document": document
+            }
+            for metadata, distance, document in self._hits(results)
+        ]
 
     def search_products(self, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
         """Search products for relevant items"""
@@ -172,31 +298,29 @@ class VectorDB:
             self.setup_collections()
 
         results = self.products_collection.query(
-            query_texts=[query],
-            n_results=n_results
+            query_embeddings=[self.embed(query)],
+            n_results=n_results,
+            include=QUERY_INCLUDE
         )
 
-        formatted_results = []
-        if results["metadatas"] and results["metadatas"][0]:
-            for i, metadata in enumerate(results["metadatas"][0]):
-                result = {
-                    "sku": metadata["sku"],
-                    "name": metadata["name"],
-                    "arm_type": metadata["arm_type"],
-                    "size_max_inch": metadata["size_max_inch"],
-                    "vesa_options": json.loads(metadata["vesa_options"]),
-                    "weight_per_arm_kg": metadata["weight_per_arm_kg"],
-                    "desk_thickness_mm": metadata["desk_thickness_mm"],
-                    "compatibility_notes": metadata["compatibility_notes"],
-                    "url": metadata["url"],
-                    "image_url": metadata["image_url"],
-                    "includes": json.loads(metadata["includes"]),
-                    "distance": results["distances"][0][i] if results["distances"] else 0,
-                    "document": results["documents"][0][i] if results["documents"] else ""
-                }
-                formatted_results.append(result)
-
-        return formatted_results
+        return [
+            {
+                "sku": metadata["sku"],
+                "name": metadata["name"],
+                "arm_type": metadata["arm_type"],
+                "size_max_inch": metadata["size_max_inch"],
+                "vesa_options": _split_list(metadata["vesa_options"]),
+                "weight_per_arm_kg": metadata["weight_per_arm_kg"],
+                "desk_thickness_mm": metadata["desk_thickness_mm"],
+                "compatibility_notes": metadata["compatibility_notes"],
+                "url": metadata["url"],
+                "image_url": metadata["image_url"],
+                "includes": _split_list(metadata["includes"]),
+                "distance": distance,
+                "document": document
+            }
+            for metadata, distance, document in self._hits(results)
+        ]
 
     def initialize_with_data(self, data_processor: DataProcessor):
         """Initialize vector database with data from processor"""